@@ -0,0 +1,91 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from file_transfer import RequestReader
+
+# Benchmark: small-request throughput of a server with per-request logging on and off.
+# Each mode starts the server with its log settings (stderr goes to a log file) and
+# runs the same load: CLIENTS connections each sending REQUESTS small GETs.
+
+MODES = [
+    ("direct INFO", dict(FILE_LOG_QUEUE='0', FILE_LOG_LEVEL='INFO')),
+    ("queue INFO", dict(FILE_LOG_LEVEL='INFO')),
+    ("queue INFO 1%", dict(FILE_LOG_LEVEL='INFO', FILE_LOG_SAMPLE='0.01')),
+    ("production", dict(FILE_ENV='production')),
+]
+ADDRESS = ('127.0.0.1', 13337)
+
+
+def start(script, workers, workdir, env):
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+    with open(os.path.join(workdir, 'uploads', 'small.txt'), 'wb') as f:
+        f.write(os.urandom(1024))
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    process = subprocess.Popen([sys.executable, script_path, str(workers), str(ADDRESS[1])], cwd=workdir,
+                               env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=log)
+    log.close()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(ADDRESS, timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{script} did not start")
+
+
+def client(requests, errors):
+    with socket.create_connection(ADDRESS) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = RequestReader(sock)
+        for _ in range(requests):
+            sock.sendall(b"GET small.txt\r\n\r\n")
+            response, _ = reader.read_request()
+            if response is None or not response.startswith(b'{"status": "OK"'):
+                errors.append(response)
+
+
+def measure(clients, requests):
+    errors = []
+    threads = [threading.Thread(target=client, args=(requests, errors)) for _ in range(clients)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+    return clients * requests / elapsed, len(errors)
+
+
+def main():
+    script = sys.argv[1] if len(sys.argv) > 1 else 'file_server_threadpool.py'
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    requests = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+
+    print(f"{script} with {workers} workers, {clients} clients x {requests} GETs of 1 KiB")
+    print(f"{'logging':>16} {'req/s':>10} {'log bytes':>12} {'errors':>7}")
+    for label, env in MODES:
+        workdir = tempfile.mkdtemp(prefix='bench-logging-')
+        process = start(script, workers, workdir, env)
+        try:
+            measure(clients, requests // 10)  # warm-up
+            rate, errors = measure(clients, requests)
+        finally:
+            process.terminate()
+            process.wait()
+        log_size = os.path.getsize(os.path.join(workdir, 'server.log'))
+        shutil.rmtree(workdir, ignore_errors=True)
+        print(f"{label:>16} {rate:>10.0f} {log_size:>12} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import socket
+import sys
+import threading
+import time
+
+from file_transfer import RequestReader, TERMINATOR
+
+# Micro-benchmark: cost of receiving one terminator-delimited request versus its size,
+# comparing the old "buffer += chunk / terminator in buffer" loop with RequestReader.
+
+
+def legacy_receive(connection, chunk_size=2**20):
+    buffer = b''
+    while True:
+        chunk = connection.recv(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        if TERMINATOR in buffer:
+            return buffer
+    return buffer
+
+
+def reader_receive(connection, chunk_size=2**20):
+    request, _ = RequestReader(connection, chunk_size).read_request()
+    return request
+
+
+def measure(receive, payload, repeat):
+    best = None
+    for _ in range(repeat):
+        server, client = socket.socketpair()
+        sender = threading.Thread(target=client.sendall, args=(payload,))
+        start = time.perf_counter()
+        sender.start()
+        receive(server)
+        elapsed = time.perf_counter() - start
+        sender.join()
+        server.close()
+        client.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    max_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    sizes = [64 * 1024, 256 * 1024, 1024 * 1024]
+    mb = 4
+    while mb <= max_mb:
+        sizes.append(mb * 1024 * 1024)
+        mb *= 2
+
+    print(f"{'request size':>14} {'legacy (s)':>12} {'reader (s)':>12} {'speedup':>8}")
+    for size in sizes:
+        payload = b"ADD bench.bin " + b"A" * size + TERMINATOR
+        legacy = measure(legacy_receive, payload, repeat)
+        reader = measure(reader_receive, payload, repeat)
+        print(f"{size:>14} {legacy:>12.4f} {reader:>12.4f} {legacy / reader:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
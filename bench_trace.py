@@ -0,0 +1,49 @@
+import shutil
+import sys
+import tempfile
+import timeit
+
+from bench_logging import measure, start
+from file_trace import phase
+
+# Benchmark: cost of request tracing. First the price of one phase() in a thread that
+# is not tracing, then small-GET throughput of a server with tracing off and on
+# (logging at production level, so it does not hide the difference).
+
+MODES = [
+    ("off", dict(FILE_ENV='production', FILE_TRACE='0')),
+    ("on", dict(FILE_ENV='production', FILE_TRACE='1')),
+]
+
+
+def phase_cost(number=10**6):
+    def traced():
+        with phase('bench'):
+            pass
+    return timeit.timeit(traced, number=number) / number * 1e9
+
+
+def main():
+    script = sys.argv[1] if len(sys.argv) > 1 else 'file_server_threadpool.py'
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    requests = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+
+    print(f"phase() while not tracing: {phase_cost():.0f} ns")
+    print(f"{script} with {workers} workers, {clients} clients x {requests} GETs of 1 KiB")
+    print(f"{'tracing':>8} {'req/s':>10} {'errors':>7}")
+    for label, env in MODES:
+        workdir = tempfile.mkdtemp(prefix='bench-trace-')
+        process = start(script, workers, workdir, env)
+        try:
+            measure(clients, requests // 10)  # warm-up
+            rate, errors = measure(clients, requests)
+        finally:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+        print(f"{label:>8} {rate:>10.0f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import csv
+import os
+import platform
+import re
+import socket
+import sys
+import time
+
+import file_client_stress as stress
+
+# Benchmark runner: launches each server variant locally, sweeps
+# operation x file size x clients x server pool x client mode against it and
+# appends one row per test to a single CSV, so runs from different machines line up.
+#
+#   python benchmark.py --servers threadpool,processpool --pools 1,5 --shapes 2x4 \
+#       --ops download,upload --sizes 1MB,10MB --clients 1,5,50 --client-modes thread,process
+
+SERVERS = {
+    "threadpool": "file_server_threadpool.py",
+    "processpool": "file_server_processpool.py",
+    "hybrid": "file_server_hybrid.py",
+    "asyncio": "file_server_asyncio.py",
+}
+CLIENT_MODES = ("thread", "process")
+COLUMNS = ("run", "host", "cpus", "python", "server", "server_pool", "operation", "file_size",
+           "clients", "client_mode", "total_time", "avg_client_time", "avg_throughput",
+           "client_success", "client_fail", "compression_ratio", "cpu_time")
+UNITS = {"": 1, "B": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30}
+
+
+def parse_size(text):
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?B?)\s*", text.upper())
+    if not match:
+        raise ValueError(f"Invalid size '{text}', expected e.g. 512KB or 10MB")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def split_list(text):
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_file(label):
+    # Random (incompressible) content of the given size, plus its edited copy for upload_delta
+    name = f"bench-{label}.bin"
+    size = parse_size(label)
+    if not os.path.exists(name) or os.path.getsize(name) != size:
+        print(f"Generating {name}...")
+        with open(name, "wb") as f:
+            for offset in range(0, size, 2**20):
+                f.write(os.urandom(min(2**20, size - offset)))
+        if os.path.exists(stress.edited_path(name)):
+            os.remove(stress.edited_path(name))
+    if not os.path.exists(stress.edited_path(name)):
+        stress.write_edited(name)
+    return name
+
+
+def seed_uploads(names):
+    # Downloads need the files on the server; start_server seeds only its own test files
+    os.makedirs("uploads", exist_ok=True)
+    for name in names:
+        target = os.path.join("uploads", name)
+        if not os.path.exists(target) or os.path.getsize(target) != os.path.getsize(name):
+            with open(name, "rb") as src, open(target, "wb") as dst:
+                dst.write(src.read())
+
+
+class ResultWriter:
+    # Appends rows to the results CSV, writing the header to a new (or differently shaped) file
+    def __init__(self, path):
+        self.path = path
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), None)
+            if tuple(header or ()) != COLUMNS:
+                backup_path = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}.bak"
+                os.replace(path, backup_path)
+                print(f"Existing {path} has different columns, moved to {backup_path}")
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerow(COLUMNS)
+
+    def write(self, row):
+        # One row at a time, so an interrupted sweep keeps what it measured
+        with open(self.path, "a", newline="") as f:
+            csv.writer(f).writerow([row.get(column, "") for column in COLUMNS])
+
+
+def sweep(server, pool, args, files, writer, run):
+    script = SERVERS[server]
+    port = args.port or free_port()
+    stress.server_address = ("127.0.0.1", port)
+    process = stress.start_server(script, pool, port)
+    try:
+        if not stress.wait_for_server(process, args.startup_timeout):
+            print(f"Server {server} ({pool}) did not start on port {port}, skipping")
+            return 0
+        count = 0
+        for operation in args.ops:
+            for label, name in files:
+                for clients in args.clients:
+                    for client_mode in args.client_modes:
+                        result = stress.run_stress_test(operation, name, clients, pool, client_mode)
+                        writer.write(dict(result, run=run, host=platform.node(), cpus=os.cpu_count(),
+                                          python=platform.python_version(), server=server, client_mode=client_mode,
+                                          operation=operation, file_size=parse_size(label)))
+                        count += 1
+        return count
+    finally:
+        stress.stop_server(process)
+        # Pooled connections pointed at the server that was just stopped
+        stress.connection_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch every server variant and sweep the benchmark matrix")
+    parser.add_argument("--servers", default="threadpool,processpool,hybrid,asyncio",
+                        help=f"Server variants to launch, of: {', '.join(SERVERS)}")
+    parser.add_argument("--pools", default="1,5,50",
+                        help="Worker counts for threadpool, processpool and asyncio")
+    parser.add_argument("--shapes", default="2x4",
+                        help="PROCESSESxTHREADS shapes for hybrid")
+    parser.add_argument("--ops", default="download,upload,download_binary,upload_binary",
+                        help="Operations, as named by file_client_stress (e.g. upload_dedup, download_zlib)")
+    parser.add_argument("--sizes", default="10MB,50MB,100MB", help="File sizes, e.g. 64KB,1MB,10MB")
+    parser.add_argument("--clients", default="1,5,50", help="Concurrent client counts")
+    parser.add_argument("--client-modes", default="thread,process",
+                        help="Run clients as threads, processes, or both")
+    parser.add_argument("--port", type=int, default=0,
+                        help="Port to launch servers on (default: a free port for each launch)")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="Seconds to wait for a server")
+    parser.add_argument("--workdir", default="benchmark-work",
+                        help="Directory holding the test files and the servers' uploads/")
+    parser.add_argument("--output", default="benchmark_results.csv", help="Results CSV (appended)")
+    args = parser.parse_args()
+
+    args.ops = split_list(args.ops)
+    args.clients = [int(c) for c in split_list(args.clients)]
+    args.client_modes = split_list(args.client_modes)
+    servers = split_list(args.servers)
+    for server in servers:
+        if server not in SERVERS:
+            parser.error(f"unknown server '{server}', expected one of: {', '.join(SERVERS)}")
+    for mode in args.client_modes:
+        if mode not in CLIENT_MODES:
+            parser.error(f"unknown client mode '{mode}', expected thread or process")
+    try:
+        sizes = split_list(args.sizes)
+        for label in sizes:
+            parse_size(label)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Results land next to where the benchmark was started, test data under the workdir
+    output = os.path.abspath(args.output)
+    writer = ResultWriter(output)
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+
+    files = [(label, create_file(label)) for label in sizes]
+    seed_uploads([name for _, name in files])
+
+    run = time.strftime("%Y%m%d-%H%M%S")
+    launches = []
+    for server in servers:
+        pools = split_list(args.shapes) if server == "hybrid" else split_list(args.pools)
+        launches += [(server, pool) for pool in pools]
+
+    print(f"Run {run}: {len(launches)} server launches x {len(args.ops)} operations x {len(files)} sizes "
+          f"x {len(args.clients)} client counts x {len(args.client_modes)} client modes")
+    total = 0
+    for server, pool in launches:
+        total += sweep(server, pool, args, files, writer, run)
+    print(f"✅ {total} results appended to {output}")
+    return 0 if total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Total bytes of encoded GET responses kept per process; FILE_CACHE_BYTES=0 disables the cache
+RESPONSE_CACHE_BYTES = int(os.environ.get('FILE_CACHE_BYTES', 256 * 2**20))
+# Largest single response kept: bigger files are streamed from disk instead of being built in memory
+RESPONSE_ENTRY_BYTES = int(os.environ.get('FILE_CACHE_ENTRY_BYTES', 4 * 2**20))
+
+
+class ResponseCache:
+    """
+    Byte-budgeted LRU cache of ready-to-send responses.
+
+    Keys are (filename, size, mtime_ns, inode) so a replaced file never matches a
+    stale entry, even in another process; invalidate() drops a name eagerly after
+    add/delete so its bytes do not wait for eviction.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES, max_entry_bytes=RESPONSE_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def fits(self, size):
+        return 0 < size <= self.max_entry_bytes
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.fits(len(value)):
+            return False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            while self.entries and self.size + len(value) > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+            self.entries[key] = value
+            self.size += len(value)
+        return True
+
+    def invalidate(self, filename):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == filename]:
+                self.size -= len(self.entries.pop(key))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes,
+                        max_entry_bytes=self.max_entry_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        hit_rate=round(self.hits / lookups, 4) if lookups else 0.0)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function and callers arriving while it runs wait for and share its result.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return dict(in_flight=len(self.calls), leaders=self.leaders, shared=self.shared)
@@ -1,26 +1,28 @@
-from socket import socket, AF_INET, SOCK_STREAM
 import base64
 import json
 
+from file_transfer import ConnectionPool, RequestReader, ValidatorCache
+
 SERVER_ADDRESS = ('localhost', 45000)
 
+# One connection is kept open for the whole session and reopened if the server closed it
+connection_pool = ConnectionPool(max_idle=1)
+# ETags of the files downloaded this session; an unchanged file is not downloaded again
+validator_cache = ValidatorCache()
+
 def send_request(command):
-    with socket(AF_INET, SOCK_STREAM) as client_socket:
-        client_socket.connect(SERVER_ADDRESS)
-        client_socket.sendall(f"{command}\r\n".encode('utf-8'))
+    def exchange(client_socket):
+        client_socket.sendall(f"{command}\r\n\r\n".encode('utf-8'))
+        full_response, _ = RequestReader(client_socket).read_request()
+        if full_response is None:
+            raise ConnectionError("Connection closed before response was complete")
+        return full_response
 
-        full_response = b""
-        while True:
-            data = client_socket.recv(4096)
-            if not data:
-                break
-            full_response += data
-            if b"\r\n\r\n" in full_response:
-                break
-        
-        response_text = full_response.decode('utf-8').strip()
-        print("Response:\n", response_text)
-        return response_text
+    full_response = connection_pool.request(SERVER_ADDRESS, exchange)
+
+    response_text = full_response.decode('utf-8').strip()
+    print("Response:\n", response_text)
+    return response_text
 
 def list_files():
     print("Requesting file list...")
@@ -28,13 +30,18 @@ def list_files():
 
 def download_file():
     filename = input("Enter the filename to download: ").strip()
-    response_text = send_request(f"GET {filename}")
+    etag = validator_cache.get(filename)
+    response_text = send_request(f"GET {filename} {etag}" if etag else f"GET {filename}")
     try:
         resp_json = json.loads(response_text)
-        if resp_json.get("status") == "OK":
+        if resp_json.get("status") == "NOT_MODIFIED":
+            print(f"File '{filename}' tidak berubah, salinan lokal dipakai.")
+        elif resp_json.get("status") == "OK":
             file_data_b64 = resp_json.get("data_file", "")
             with open(filename, "wb") as f:
                 f.write(base64.b64decode(file_data_b64))
+            if "etag" in resp_json:
+                validator_cache.put(filename, resp_json["etag"])
             print(f"File '{filename}' berhasil didownload dan disimpan.")
         else:
             print("Error:", resp_json.get("data"))
@@ -1,38 +1,97 @@
 import socket
 import json
 import base64
+import hashlib
 import os
 import time
 import logging
+import lzma
+import mmap
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
+import random
+import shutil
+import subprocess
+import sys
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 
+from file_compress import IDENTITY, SAMPLE_SIZE, is_compressible
+from file_delta import LITERAL, compute_delta, delta_length, iter_delta
+from file_transfer import (ConnectionPool, RequestReader, ValidatorCache, read_frame, PIPELINE_DEPTH,
+                           RANGE_HEADER, STATUS_OK, STATUS_ERROR)
+
+# Connections are reused across commands (the servers keep them open between requests)
+connection_pool = ConnectionPool()
+# ETags of downloaded files, sent with conditional GETs
+validator_cache = ValidatorCache()
 server_address = ('127.0.0.1', 13337)  
+segment_size = 8 * 2**20
 
 def send_command(command_str):
+    def exchange(sock):
+        sock.sendall(command_str.encode())
+        response, _ = RequestReader(sock, 2**20).read_request()
+        if response is None:
+            raise ConnectionError("Connection closed before response was complete")
+        return response
+
     try:
-        with socket.create_connection(server_address, timeout=300) as sock:  
-            sock.sendall(command_str.encode())
-            
-            data_received = b""
-            end_marker = b"\r\n\r\n"
-            
-            while True:
-                chunk = sock.recv(2**20)  
-                if not chunk:
-                    break
-                data_received += chunk
-                if end_marker in data_received[-8:]:  
-                    break
-            response_str = data_received.decode()
-            response_str = response_str.strip()
-            
-            return json.loads(response_str)
+        response_str = connection_pool.request(server_address, exchange).decode().strip()
+        return json.loads(response_str)
     except Exception as e:
         print(f"Error: {e}")
         return {"status": "ERROR", "message": str(e)}
 
+def send_binary_command(command_str, payload=None):
+    def exchange(sock):
+        sock.sendall(command_str.encode())
+        if payload:
+            sock.sendall(payload)
+        status, name, data, _ = read_frame(sock)
+        return status, name, data
+
+    try:
+        return connection_pool.request(server_address, exchange)
+    except Exception as e:
+        print(f"Error: {e}")
+        return STATUS_ERROR, "", str(e).encode()
+
+def send_pipelined(commands, window=PIPELINE_DEPTH):
+    """
+    Send commands back-to-back on one connection as "#<index> COMMAND", keeping up to
+    `window` of them in flight. Responses may arrive in any order; they are matched
+    by id and returned in command order.
+    """
+    def exchange(sock):
+        reader = RequestReader(sock, 2**20)
+        results = [None] * len(commands)
+        sent = received = 0
+        while received < len(commands):
+            batch = []
+            while sent < len(commands) and sent - received < window:
+                batch.append(f"#{sent} {commands[sent]}\r\n\r\n")
+                sent += 1
+            if batch:
+                sock.sendall("".join(batch).encode())
+            response, _ = reader.read_request()
+            if response is None:
+                message = f"Connection closed after {received} of {len(commands)} responses"
+                # Only an exchange that got no response at all may be retried on a new connection
+                raise ConnectionError(message) if received == 0 else RuntimeError(message)
+            hasil = json.loads(response)
+            results[int(hasil.pop('id'))] = hasil
+            received += 1
+        return results
+
+    try:
+        return connection_pool.request(server_address, exchange)
+    except Exception as e:
+        print(f"Error: {e}")
+        return [{"status": "ERROR", "message": str(e)}] * len(commands)
+
 def remote_list():
     command_str = "LIST\r\n\r\n"
     hasil = send_command(command_str)
@@ -47,8 +106,10 @@ def remote_list():
         print(f"Gagal: {hasil.get('data', 'Unknown error')}")
         return False, "Gagal"
 
-def remote_get(filename=""):
-    command_str = f"GET {filename}\r\n\r\n"
+def remote_get(filename="", conditional=False):
+    # conditional: offer the ETag of the local copy, so an unchanged file is not sent again
+    etag = validator_cache.get(filename) if conditional else None
+    command_str = f"GET {filename} {etag}\r\n\r\n" if etag else f"GET {filename}\r\n\r\n"
     print(f"Sending GET request for {filename}...")
     
     start_time = time.time()
@@ -57,6 +118,9 @@ def remote_get(filename=""):
     
     print(f"Response received in {end_time - start_time:.2f} seconds")
     
+    if hasil['status'] == 'NOT_MODIFIED':
+        print(f"File {filename} tidak berubah, salinan lokal dipakai")
+        return True, "Success"
     if (hasil['status']=='OK'):
         namafile = hasil['data_namafile']
         print(f"Decoding file data for {namafile}...")
@@ -65,6 +129,8 @@ def remote_get(filename=""):
         print(f"Writing {len(isifile)} bytes to file...")
         with open(namafile, 'wb') as fp:
             fp.write(isifile)
+        if conditional and 'etag' in hasil:
+            validator_cache.put(namafile, hasil['etag'])
         
         print(f"File {filename} berhasil didownload ({len(isifile)} bytes)")
         return True, "Success"
@@ -106,6 +172,337 @@ def remote_add(filename=""):
         print(f"Gagal: {result.get('data', 'Unknown error')}")
         return False, "Gagal"
     
+def decompress(data, encoding):
+    if encoding == 'zlib':
+        return zlib.decompress(data)
+    if encoding == 'lzma':
+        return lzma.decompress(data)
+    return data
+
+def remote_zget(filename="", algorithm="zlib"):
+    # Returns (success, message, stats); stats has the compression ratio and the
+    # client (decompression) and server (compression) CPU seconds
+    print(f"Sending ZGET request for {filename} ({algorithm})...")
+    hasil = send_command(f"ZGET {filename} {algorithm}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"Gagal: {hasil.get('data', 'Unknown error')}")
+        return False, "Gagal", {}
+
+    start_cpu = time.thread_time()
+    isifile = decompress(base64.b64decode(hasil['data_file']), hasil['encoding'])
+    client_cpu = time.thread_time() - start_cpu
+    if len(isifile) != hasil['size']:
+        print(f"Gagal: expected {hasil['size']} bytes, got {len(isifile)}")
+        return False, "Ukuran tidak cocok", {}
+
+    with open(hasil['data_namafile'], 'wb') as fp:
+        fp.write(isifile)
+    print(f"File {filename} berhasil didownload ({hasil['size']} bytes, "
+          f"{hasil['compressed_size']} on the wire, {hasil['encoding']})")
+    return True, "Success", dict(ratio=hasil['compressed_size'] / hasil['size'] if hasil['size'] else 1.0,
+                                 client_cpu=client_cpu, server_cpu=hasil['cpu_time'])
+
+def remote_zadd(filename="", algorithm="zlib"):
+    # Compresses locally unless a sample shows it will not pay off, then sends ZADD;
+    # returns (success, message, stats) like remote_zget
+    if not os.path.exists(filename):
+        print(f"File {filename} tidak ditemukan...")
+        return False, "File tidak ditemukan", {}
+
+    with open(filename, 'rb') as f:
+        content = f.read()
+    start_cpu = time.thread_time()
+    encoding = algorithm if is_compressible(filename, content[:SAMPLE_SIZE]) else IDENTITY
+    if encoding == 'zlib':
+        payload = zlib.compress(content, 6)
+    elif encoding == 'lzma':
+        payload = lzma.compress(content, preset=1)
+    else:
+        payload = content
+    client_cpu = time.thread_time() - start_cpu
+
+    print(f"Sending ZADD request for {filename} ({len(content)} bytes, {len(payload)} on the wire, {encoding})...")
+    result = send_command(f"ZADD {filename} {encoding} {base64.b64encode(payload).decode()}\r\n\r\n")
+    if result['status'] != 'OK':
+        print(f"Gagal: {result.get('data', 'Unknown error')}")
+        return False, "Gagal", {}
+    print(f"File {filename} berhasil diupload")
+    return True, "Success", dict(ratio=len(payload) / len(content) if content else 1.0,
+                                 client_cpu=client_cpu, server_cpu=result.get('cpu_time', 0.0))
+
+def remote_bget(filename=""):
+    print(f"Sending BGET request for {filename}...")
+
+    start_time = time.time()
+    status, namafile, isifile = send_binary_command(f"BGET {filename}\r\n\r\n")
+    end_time = time.time()
+
+    print(f"Response received in {end_time - start_time:.2f} seconds")
+
+    if status == STATUS_OK:
+        print(f"Writing {len(isifile)} bytes to file...")
+        with open(namafile, 'wb') as fp:
+            fp.write(isifile)
+
+        print(f"File {filename} berhasil didownload ({len(isifile)} bytes)")
+        return True, "Success"
+    else:
+        print(f"Gagal: {bytes(isifile).decode(errors='replace')}")
+        return False, "Gagal"
+
+def remote_bput(filename=""):
+    if not os.path.exists(filename):
+        print(f"File {filename} tidak ditemukan...")
+        return False, "File tidak ditemukan"
+
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    print(f"Sending BPUT request ({len(content)} bytes)...")
+
+    start_time = time.time()
+    status, _, message = send_binary_command(f"BPUT {filename} {len(content)}\r\n\r\n", content)
+    end_time = time.time()
+
+    print(f"Response received in {end_time - start_time:.2f} seconds")
+
+    if status == STATUS_OK:
+        print(f"File {filename} berhasil diupload")
+        return True, "Success"
+    else:
+        print(f"Gagal: {bytes(message).decode(errors='replace')}")
+        return False, "Gagal"
+
+# (path, size, mtime_ns) -> sha256, so unchanged local files are hashed only once
+content_hashes = {}
+
+def local_digest(filename):
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    digest = content_hashes.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+        digest = content_hashes[key] = h.hexdigest()
+    return digest
+
+def remote_dedup_add(filename=""):
+    # Uploads only if the server does not hold this content yet; otherwise just links the name to it
+    if not os.path.exists(filename):
+        print(f"File {filename} tidak ditemukan...")
+        return False, "File tidak ditemukan"
+
+    digest = local_digest(filename)
+    hasil = send_command(f"HAS {digest}\r\n\r\n")
+    if hasil['status'] == 'OK' and hasil['data'][0].get('present'):
+        print(f"Server already holds {filename} ({digest[:12]}), sending LINK...")
+        hasil = send_command(f"LINK {filename} {digest}\r\n\r\n")
+        if hasil['status'] == 'OK':
+            print(f"File {filename} berhasil diupload (linked)")
+            return True, "Success"
+        # The content may have been removed since HAS; fall back to sending it
+        print(f"LINK failed: {hasil.get('data', 'Unknown error')}")
+    return remote_bput(filename)
+
+def remote_delta_add(filename="", source=None, max_literal_ratio=0.5):
+    # Re-uploads `filename` with the content of local file `source` (default: filename), sending
+    # only what differs from the server's copy. Falls back to BPUT when the server has no copy
+    # or more than max_literal_ratio of the file would have to be sent anyway.
+    source = source or filename
+    if not os.path.exists(source):
+        print(f"File {source} tidak ditemukan...")
+        return False, "File tidak ditemukan"
+
+    hasil = send_command(f"SIGS {filename}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"No server copy of {filename} ({hasil.get('data')}), uploading in full...")
+        return remote_bput_as(source, filename)
+
+    digest = local_digest(source)
+    if digest == hasil['etag']:
+        print(f"File {filename} tidak berubah, tidak ada yang dikirim")
+        return True, "Unchanged"
+
+    with open(source, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return remote_bput_as(source, filename)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start_time = time.time()
+            ops = compute_delta(data, hasil['signatures'], hasil['block_size'], hasil['size'],
+                                max_literal=int(size * max_literal_ratio))
+            if ops is None:
+                print(f"{filename} changed too much for a delta, uploading in full...")
+                return remote_bput_as(source, filename)
+            payload = b''.join(iter_delta(ops, data))
+        literal = sum(length for op, _, length in ops if op == LITERAL)
+        print(f"Delta for {filename}: {len(payload)} bytes ({literal} literal) instead of {size}, "
+              f"computed in {time.time() - start_time:.2f} seconds")
+
+    status, _, message = send_binary_command(
+        f"BDELTA {filename} {hasil['etag']} {digest} {delta_length(ops)}\r\n\r\n", payload)
+    if status == STATUS_OK:
+        print(f"File {filename} berhasil diupload (delta)")
+        return True, "Success"
+    print(f"Gagal: {bytes(message).decode(errors='replace')}")
+    return False, "Gagal"
+
+def remote_bput_as(source, filename):
+    # BPUT of local file `source` under the server name `filename`
+    with open(source, 'rb') as f:
+        content = f.read()
+    status, _, message = send_binary_command(f"BPUT {filename} {len(content)}\r\n\r\n", content)
+    if status == STATUS_OK:
+        print(f"File {filename} berhasil diupload")
+        return True, "Success"
+    print(f"Gagal: {bytes(message).decode(errors='replace')}")
+    return False, "Gagal"
+
+def fetch_range(sock, filename, offset, length):
+    # One BRANGE round trip on an open connection; returns (size, mtime_ns, data)
+    sock.sendall(f"BRANGE {filename} {offset} {length}\r\n\r\n".encode())
+    status, _, payload, _ = read_frame(sock)
+    if status != STATUS_OK:
+        raise RuntimeError(bytes(payload).decode(errors='replace'))
+    _, size, mtime_ns = RANGE_HEADER.unpack_from(payload)
+    return size, mtime_ns, memoryview(payload)[RANGE_HEADER.size:]
+
+def write_at(fd, data, offset):
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+def remote_segmented_get(filename="", connections=4):
+    print(f"Sending BRANGE requests for {filename} over {connections} connections...")
+
+    start_time = time.time()
+    part_name = f".{filename}.{uuid.uuid4().hex}.part"
+    fd = None
+    try:
+        with connection_pool.connection(server_address) as sock:
+            # The first segment also tells us the file size and version every other segment must match
+            size, mtime_ns, data = fetch_range(sock, filename, 0, segment_size)
+
+            fd = os.open(part_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            if size and hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            write_at(fd, data, 0)
+
+            segments = deque(range(segment_size, size, segment_size))
+
+            def fetch_segments(conn):
+                # Each connection keeps taking the next unfetched segment until none are left
+                while True:
+                    try:
+                        offset = segments.popleft()
+                    except IndexError:
+                        return
+                    seg_size, seg_mtime, data = fetch_range(conn, filename, offset, segment_size)
+                    if (seg_size, seg_mtime) != (size, mtime_ns):
+                        raise RuntimeError(f"File {filename} changed during download")
+                    write_at(fd, data, offset)
+
+            def run_connection(conn=None):
+                if conn is not None:
+                    return fetch_segments(conn)
+                with connection_pool.connection(server_address) as conn:
+                    return fetch_segments(conn)
+
+            workers = min(connections, len(segments))
+            if workers:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(run_connection, sock)]
+                    futures += [executor.submit(run_connection) for _ in range(workers - 1)]
+                    for future in futures:
+                        future.result()
+
+        os.close(fd)
+        fd = None
+        os.replace(part_name, filename)
+    except Exception as e:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(part_name):
+            os.remove(part_name)
+        print(f"Gagal: {e}")
+        return False, "Gagal"
+
+    end_time = time.time()
+    print(f"File {filename} berhasil didownload ({size} bytes, {connections} koneksi) "
+          f"in {end_time - start_time:.2f} seconds")
+    return True, "Success"
+
+def remote_chunked_add(filename="", connections=4, attempts=3):
+    if not os.path.exists(filename):
+        print(f"File {filename} tidak ditemukan...")
+        return False, "File tidak ditemukan"
+
+    size = os.path.getsize(filename)
+    hasil = send_command(f"USTART {filename} {size} {segment_size}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"Gagal: {hasil.get('data', 'Unknown error')}")
+        return False, "Gagal"
+    session = hasil['data_session']
+    missing = list(range(hasil['chunks']))
+    print(f"Uploading {filename} ({size} bytes) as {len(missing)} chunks over {connections} connections...")
+
+    def send_chunks(chunks):
+        # Each connection keeps taking the next unsent chunk until none are left
+        with connection_pool.connection(server_address) as sock, open(filename, 'rb') as f:
+            while True:
+                try:
+                    index = chunks.popleft()
+                except IndexError:
+                    return
+                offset = index * segment_size
+                length = min(segment_size, size - offset)
+                sock.sendall(f"UCHUNK {session} {index} {length}\r\n\r\n".encode())
+                sock.sendfile(f, offset, length)
+                status, _, message, _ = read_frame(sock)
+                if status != STATUS_OK:
+                    raise RuntimeError(bytes(message).decode(errors='replace'))
+
+    start_time = time.time()
+    for attempt in range(attempts):
+        if not missing:
+            break
+        chunks = deque(missing)
+        with ThreadPoolExecutor(max_workers=min(connections, len(missing))) as executor:
+            futures = [executor.submit(send_chunks, chunks) for _ in range(min(connections, len(missing)))]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Connection interrupted: {e}")
+
+        # Only the chunks the server does not have yet are sent again
+        status = send_command(f"USTATUS {session}\r\n\r\n")
+        if status['status'] != 'OK':
+            print(f"Gagal: {status.get('data', 'Unknown error')}")
+            return False, "Gagal"
+        missing = status['missing']
+
+    if missing:
+        send_command(f"UABORT {session}\r\n\r\n")
+        print(f"Gagal: {len(missing)} chunk tidak terkirim")
+        return False, "Gagal"
+
+    result = send_command(f"UCOMMIT {session}\r\n\r\n")
+    end_time = time.time()
+    print(f"Response received in {end_time - start_time:.2f} seconds")
+
+    if result['status'] == 'OK':
+        print(f"File {filename} berhasil diupload")
+        return True, "Success"
+    else:
+        print(f"Gagal: {result.get('data', 'Unknown error')}")
+        return False, "Gagal"
+
 def remote_delete(filename=""):
     command_str = f"DELETE {filename}\r\n\r\n"
     hasil = send_command(command_str)
@@ -117,12 +514,69 @@ def remote_delete(filename=""):
         print(f"Gagal: {hasil.get('data', 'Unknown error')}")
         return False, "Gagal"
 
-def stress_worker(task_type, filename):
+def remote_mget(filenames):
+    hasil = send_command(f"MGET {' '.join(filenames)}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"Gagal: {hasil.get('data', hasil.get('message', 'Unknown error'))}")
+        return []
+    for item in hasil['data']:
+        if item['status'] == 'OK':
+            with open(item['data_namafile'], 'wb') as fp:
+                fp.write(base64.b64decode(item['data_file']))
+    return hasil['data']
+
+def remote_mdelete(filenames):
+    hasil = send_command(f"MDELETE {' '.join(filenames)}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"Gagal: {hasil.get('data', hasil.get('message', 'Unknown error'))}")
+        return []
+    return hasil['data']
+
+def remote_stat(filenames):
+    hasil = send_command(f"STAT {' '.join(filenames)}\r\n\r\n")
+    if hasil['status'] != 'OK':
+        print(f"Gagal: {hasil.get('data', hasil.get('message', 'Unknown error'))}")
+        return []
+    return hasil['data']
+
+def delta_target(filename, worker_id):
+    # Every upload_delta client syncs its own server copy, so concurrent clients do not race each other's SIGS/BDELTA
+    return f"{filename}.{worker_id}"
+
+def stress_worker(task_type, filename, worker_id=0):
     start = time.time()
+    stats = {}
     print(f"----> Starting {task_type} for {filename}")
-    if task_type == "upload":
+    if task_type in ("download_zlib", "download_lzma"):
+        success, res, stats = remote_zget(filename, task_type.split("_", 1)[1])
+    elif task_type in ("upload_zlib", "upload_lzma"):
+        success, res, stats = remote_zadd(filename, task_type.split("_", 1)[1])
+        print(f"----> Uploading {filename} completed")
+    elif task_type == "upload":
         success, res = remote_add(filename)
         print(f"----> Uploading {filename} completed")
+    elif task_type == "upload_binary":
+        success, res = remote_bput(filename)
+        print(f"----> Uploading {filename} completed")
+    elif task_type == "upload_delta":
+        # Switches the server copy between the original and the edited version, so every run sends a real delta
+        target = delta_target(filename, worker_id)
+        success, res = remote_delta_add(target, edited_path(filename))
+        if res == "Unchanged":
+            success, res = remote_delta_add(target, filename)
+        print(f"----> Uploading {filename} completed")
+    elif task_type == "upload_dedup":
+        success, res = remote_dedup_add(filename)
+        print(f"----> Uploading {filename} completed")
+    elif task_type == "download_conditional":
+        success, res = remote_get(filename, conditional=True)
+    elif task_type == "download_binary":
+        success, res = remote_bget(filename)
+    elif task_type.startswith("upload_chunked_k"):
+        success, res = remote_chunked_add(filename, int(task_type.rsplit("k", 1)[1]))
+        print(f"----> Uploading {filename} completed")
+    elif task_type.startswith("download_segmented_k"):
+        success, res = remote_segmented_get(filename, int(task_type.rsplit("k", 1)[1]))
     else:
         success, res = remote_get(filename)
     end = time.time()
@@ -134,16 +588,30 @@ def stress_worker(task_type, filename):
         "success": success,
         "time": elapsed,
         "throughput": size / elapsed if success and elapsed > 0 else 0,
+        "ratio": stats.get("ratio"),
+        "cpu_time": stats.get("client_cpu", 0) + stats.get("server_cpu", 0) if stats else None,
         "message": res if not success else "OK"
     }
 
-def run_stress_test(task_type, filename,  num_clients, server_pool_size=1):
-    print(f"\nTesting {task_type.upper()} - File: {filename} | Server Pool: {server_pool_size}, Clients: {num_clients}")
+def run_stress_test(task_type, filename,  num_clients, server_pool_size=1, client_mode="thread"):
+    # client_mode "process" runs each client in its own (forked) process instead of a thread
+    print(f"\nTesting {task_type.upper()} - File: {filename} | Server Pool: {server_pool_size}, "
+          f"Clients: {num_clients} ({client_mode})")
     client_results = []
 
+    if client_mode == "process":
+        executor = ProcessPoolExecutor(max_workers=num_clients, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_clients)
+
+    if task_type == "upload_delta":
+        # Seed each client's own server copy before timing starts
+        for worker_id in range(num_clients):
+            remote_bput_as(filename, delta_target(filename, worker_id))
+
     start_all = time.time()
-    with ThreadPoolExecutor(max_workers=num_clients) as executor:
-        futures = [executor.submit(stress_worker, task_type, filename) for _ in range(num_clients)]
+    with executor:
+        futures = [executor.submit(stress_worker, task_type, filename, worker_id) for worker_id in range(num_clients)]
         for future in tqdm(futures):
             client_results.append(future.result())
     end_all = time.time()
@@ -159,11 +627,15 @@ def run_stress_test(task_type, filename,  num_clients, server_pool_size=1):
     server_success = client_success
     server_failure = client_failure
     total_time = end_all - start_all
+
+    # Only the compressed transfers report a ratio and CPU time
+    ratios = [r["ratio"] for r in client_results if r["success"] and r["ratio"] is not None]
+    cpu_times = [r["cpu_time"] for r in client_results if r["success"] and r["cpu_time"] is not None]
     
     return {
         "task": task_type,
         "file": filename,
-        "client_pool": "thread",  # This is fixed as ThreadPoolExecutor
+        "client_pool": client_mode,
         "server_pool": server_pool_size,
         "clients": num_clients,
         "client_success": client_success,
@@ -172,28 +644,196 @@ def run_stress_test(task_type, filename,  num_clients, server_pool_size=1):
         "server_fail": server_failure,
         "total_time": round(total_time, 2),
         "avg_client_time": round(avg_client_time, 2),
-        "avg_throughput": round(avg_throughput, 2) if client_success else 0
+        "avg_throughput": round(avg_throughput, 2) if client_success else 0,
+        "compression_ratio": round(sum(ratios) / len(ratios), 4) if ratios else "",
+        "cpu_time": round(sum(cpu_times) / len(cpu_times), 4) if cpu_times else ""
     }
 
+def run_pipeline_test(num_requests, window, server_pool_size=1):
+    # Metadata-heavy job: ADD, GET and DELETE num_requests small files, `window` requests in flight
+    print(f"\nTesting PIPELINE - {num_requests} small files | Server Pool: {server_pool_size}, Window: {window}")
+    content = base64.b64encode(os.urandom(1024)).decode()
+    names = [f"pipe_{uuid.uuid4().hex[:8]}_{i}.txt" for i in range(num_requests)]
+    phases = [
+        ("add", [f"ADD {name} {content}" for name in names]),
+        ("get", [f"GET {name}" for name in names]),
+        ("delete", [f"DELETE {name}" for name in names]),
+    ]
+
+    results = []
+    for phase, commands in phases:
+        start = time.time()
+        responses = send_pipelined(commands, window)
+        elapsed = time.time() - start
+        success = sum(1 for r in responses if r.get('status') == 'OK')
+        results.append({
+            "task": f"metadata_{phase}_w{window}",
+            "file": f"{num_requests}x1KB",
+            "client_pool": "thread",
+            "server_pool": server_pool_size,
+            "clients": 1,
+            "client_success": success,
+            "client_fail": num_requests - success,
+            "server_success": success,
+            "server_fail": num_requests - success,
+            "total_time": round(elapsed, 2),
+            "avg_client_time": round(elapsed, 4),
+            # Requests per second rather than bytes per second
+            "avg_throughput": round(num_requests / elapsed, 2) if elapsed > 0 else 0
+        })
+        print(f"{phase.upper()}: {num_requests} requests in {elapsed:.2f} s ({results[-1]['avg_throughput']} req/s)")
+    return results
+
+def run_batch_test(num_requests, server_pool_size=1):
+    # Same small-file job as run_pipeline_test, but STAT, MGET and MDELETE each cover all files in one request
+    print(f"\nTesting BATCH - {num_requests} small files | Server Pool: {server_pool_size}")
+    content = base64.b64encode(os.urandom(1024)).decode()
+    names = [f"batch_{uuid.uuid4().hex[:8]}_{i}.txt" for i in range(num_requests)]
+    send_pipelined([f"ADD {name} {content}" for name in names])
+
+    work_dir = f".batch-{uuid.uuid4().hex[:8]}"
+    os.makedirs(work_dir)
+    cwd = os.getcwd()
+    results = []
+    try:
+        for phase, call in (("stat", remote_stat), ("mget", remote_mget), ("mdelete", remote_mdelete)):
+            # MGET writes the fetched files into the current directory
+            os.chdir(work_dir)
+            start = time.time()
+            try:
+                items = call(names)
+            finally:
+                os.chdir(cwd)
+            elapsed = time.time() - start
+            success = sum(1 for item in items if item['status'] == 'OK')
+            results.append({
+                "task": f"metadata_{phase}_batch",
+                "file": f"{num_requests}x1KB",
+                "client_pool": "thread",
+                "server_pool": server_pool_size,
+                "clients": 1,
+                "client_success": success,
+                "client_fail": num_requests - success,
+                "server_success": success,
+                "server_fail": num_requests - success,
+                "total_time": round(elapsed, 2),
+                "avg_client_time": round(elapsed, 4),
+                # Files per second rather than bytes per second
+                "avg_throughput": round(num_requests / elapsed, 2) if elapsed > 0 else 0
+            })
+            print(f"{phase.upper()}: {num_requests} files in {elapsed:.2f} s ({results[-1]['avg_throughput']} files/s)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+# Random data does not compress; the CSV files are what the compressed transfers are measured on
+BINARY_FILES = {
+    "10MB.bin": 10*1024*1024,
+    "50MB.bin": 50*1024*1024,
+    "100MB.bin": 100*1024*1024,
+}
+TEXT_FILES = {
+    "10MB.csv": 10*1024*1024,
+    "50MB.csv": 50*1024*1024,
+}
+TEST_FILES = list(BINARY_FILES) + list(TEXT_FILES)
+
+def write_csv(name, size):
+    # Log-like rows with a fixed seed, so every run compresses the same content
+    rng = random.Random(name)
+    levels = ["INFO", "INFO", "INFO", "WARNING", "ERROR"]
+    paths = ["/index.html", "/api/files", "/api/upload", "/static/app.js", "/login"]
+    with open(name, "w") as f:
+        written = f.write("id,timestamp,level,client,path,status,bytes\n")
+        row = 0
+        while written < size:
+            lines = []
+            for _ in range(1000):
+                row += 1
+                lines.append(f"{row},2025-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:"
+                             f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d},{rng.choice(levels)},"
+                             f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)},{rng.choice(paths)},"
+                             f"{rng.choice([200, 200, 200, 304, 404, 500])},{rng.randint(100, 100000)}\n")
+            chunk = "".join(lines)[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+
+def edited_path(name):
+    return os.path.join("edited", name)
+
+def write_edited(name):
+    # A copy of `name` with a few KB overwritten and a few KB inserted, the kind of change delta upload is for
+    rng = random.Random(name)
+    with open(name, 'rb') as f:
+        content = bytearray(f.read())
+    third = len(content) // 3
+    content[third:third + 4096] = rng.randbytes(4096)
+    content[2 * third:2 * third] = rng.randbytes(1000)
+    os.makedirs("edited", exist_ok=True)
+    with open(edited_path(name), 'wb') as f:
+        f.write(content)
+
 def create_files():
-    sizes = {
-        "10MB.bin": 10*1024*1024,
-        "50MB.bin": 50*1024*1024,
-        "100MB.bin": 100*1024*1024,
-    }
-    
-    for name, size in sizes.items():
+    for name, size in BINARY_FILES.items():
         if not os.path.exists(name):
             print(f"Generating {name}...")
             with open(name, "wb") as f:
                 f.write(os.urandom(size))
+        if not os.path.exists(edited_path(name)):
+            write_edited(name)
+    for name, size in TEXT_FILES.items():
+        if not os.path.exists(name):
+            print(f"Generating {name}...")
+            write_csv(name, size)
                 
+def start_server(script, *args):
+    # Launch a server variant from this directory; it serves ./uploads, seeded with the test files
+    os.makedirs("uploads", exist_ok=True)
+    for name in TEST_FILES:
+        if os.path.exists(name) and not os.path.exists(os.path.join("uploads", name)):
+            shutil.copy(name, os.path.join("uploads", name))
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    return subprocess.Popen([sys.executable, script_path, *[str(a) for a in args]],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_for_server(process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(server_address, timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
 def write_result(results):
     """
     Write test results to CSV with continuous row numbering
     """
     file_path = "final_results.csv"
+    header = ("no,operation,volume,client_pool_size,server_pool_size,avg_client_time,avg_throughput,"
+              "client_success,client_fail,server_success,server_fail,compression_ratio,cpu_time\n")
     file_exists = os.path.isfile(file_path) and os.path.getsize(file_path) > 0
+
+    if file_exists:
+        # Results written with other columns are kept aside rather than mixed with these
+        with open(file_path, "r") as f:
+            existing_header = f.readline()
+        if existing_header != header:
+            backup_path = f"{file_path}.{time.strftime('%Y%m%d-%H%M%S')}.bak"
+            os.replace(file_path, backup_path)
+            print(f"Existing {file_path} has different columns, moved to {backup_path}")
+            file_exists = False
     
     # Get the next row number if file exists
     next_row_num = 1
@@ -222,32 +862,104 @@ def write_result(results):
     with open(file_path, "a" if file_exists else "w") as f:
         if not file_exists:
             # Write header
-            f.write("no,operation,volume,client_pool_size,server_pool_size,avg_client_time,avg_throughput,client_success,client_fail,server_success,server_fail\n")
+            f.write(header)
         
         # Write data rows
         for r in results:
             f.write(f"{r['no']},{r['task']},{r['file']},{r['clients']},{r['server_pool']},"
                     f"{r['avg_client_time']},{r['avg_throughput']},{r['client_success']},"
-                    f"{r['client_fail']},{r['server_success']},{r['server_fail']}\n")
+                    f"{r['client_fail']},{r['server_success']},{r['server_fail']},"
+                    f"{r.get('compression_ratio', '')},{r.get('cpu_time', '')}\n")
     
     print(f"✅ Results appended to {file_path} (rows {results[0]['no']} to {results[-1]['no']})")
 
 
 def main():
+    import argparse
+
+    global server_address, segment_size
+    parser = argparse.ArgumentParser(description="Stress test matrix for the file servers")
+    parser.add_argument('--host', default=server_address[0], help='Server address')
+    parser.add_argument('--port', type=int, default=server_address[1],
+                        help='Server port (thread pool, process pool and asyncio servers all default to 13337)')
+    parser.add_argument('--server-pool', type=int, default=1, help='Worker count the server was started with')
+    parser.add_argument('--hybrid', default=None,
+                        help='Comma separated PxT shapes (e.g. 1x8,2x4,4x2); starts file_server_hybrid.py '
+                             'locally for each shape and runs the whole matrix against it')
+    parser.add_argument('--launch', default=None,
+                        help='Comma separated server variants (e.g. threadpool,processpool); starts '
+                             'file_server_<variant>.py locally with --server-pool workers and runs the '
+                             'whole matrix against each')
+    parser.add_argument('--segment-connections', default='1,2,4,8',
+                        help='Comma separated connection counts K for segmented downloads and '
+                             'chunked uploads (empty to skip)')
+    parser.add_argument('--segment-size', type=int, default=segment_size // 2**20,
+                        help='Segment/chunk size in MiB for segmented downloads and chunked uploads')
+    parser.add_argument('--pipeline-windows', default='1,16,64',
+                        help='Comma separated pipelining windows for the small-file metadata test '
+                             '(requests in flight on one connection; empty to skip)')
+    parser.add_argument('--pipeline-requests', type=int, default=1000,
+                        help='Number of small files in the metadata tests (pipelined and batch; 0 to skip)')
+    parser.add_argument('--no-compression', dest='compression', action='store_false',
+                        help='Skip the ZGET/ZADD compressed transfer tests')
+    args = parser.parse_args()
+    server_address = (args.host, args.port)
+    segment_size = args.segment_size * 2**20
+
+    connection_counts = [int(k) for k in args.segment_connections.split(",") if k.strip()]
+    segmented = ([f"download_segmented_k{k}" for k in connection_counts] +
+                 [f"upload_chunked_k{k}" for k in connection_counts])
+    windows = [int(w) for w in args.pipeline_windows.split(",") if w.strip()]
+
     create_files()
     combinations = [
         (t, f, c)
-        for t in ["download", "upload"]
+        for t in ["download", "download_conditional", "upload", "download_binary", "upload_binary",
+                  "upload_dedup", "upload_delta"] + segmented
         for f in ["10MB.bin", "50MB.bin", "100MB.bin"]  
         for c in [1, 5, 50]
     ]
+    if args.compression:
+        # Compressed transfers of text (compressible) and random (skipped as identity) data
+        combinations += [
+            (t, f, c)
+            for t in ["download_zlib", "download_lzma", "upload_zlib", "upload_lzma"]
+            for f in list(TEXT_FILES) + ["10MB.bin"]
+            for c in [1, 5, 50]
+        ]
     
     print("Test combinations:", combinations)
     results = []
-    
-    for task, file, clients in combinations:
-        r = run_stress_test(task, file, clients)
-        results.append(r)
+
+    def run_matrix(server_pool):
+        for task, file, clients in combinations:
+            results.append(run_stress_test(task, file, clients, server_pool))
+        for window in windows:
+            results.extend(run_pipeline_test(args.pipeline_requests, window, server_pool))
+        if args.pipeline_requests > 0:
+            results.extend(run_batch_test(args.pipeline_requests, server_pool))
+
+    servers = []
+    if args.hybrid:
+        servers += [("file_server_hybrid.py", shape.strip(), shape.strip()) for shape in args.hybrid.split(",")]
+    if args.launch:
+        servers += [(f"file_server_{name.strip()}.py", args.server_pool, f"{name.strip()}-{args.server_pool}")
+                    for name in args.launch.split(",")]
+
+    if servers:
+        for script, pool_arg, label in servers:
+            server = start_server(script, pool_arg, args.port)
+            try:
+                if not wait_for_server(server):
+                    print(f"Server {label} did not start, skipping")
+                    continue
+                run_matrix(label)
+            finally:
+                stop_server(server)
+                # Pooled connections pointed at the server that was just stopped
+                connection_pool.close()
+    else:
+        run_matrix(args.server_pool)
 
     write_result(results)
 
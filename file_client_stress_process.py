@@ -1,4 +1,3 @@
-import socket
 import json
 import base64
 import os
@@ -8,34 +7,41 @@ import multiprocessing
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+from file_transfer import ConnectionPool, RequestReader, read_frame, STATUS_OK, STATUS_ERROR
+
+# Connections are reused across commands (the servers keep them open between requests)
+connection_pool = ConnectionPool()
 server_address = ('127.0.0.1', 6666)  
 
 def send_command(command_str):
+    def exchange(sock):
+        sock.sendall(command_str.encode())
+        response, _ = RequestReader(sock, 2**20).read_request()
+        if response is None:
+            raise ConnectionError("Connection closed before response was complete")
+        return response
+
     try:
-        with socket.create_connection(server_address, timeout=300) as sock:  
-            sock.sendall(command_str.encode())
-            
-            data_received = b""
-            end_marker = b"\r\n\r\n"
-            
-            while True:
-                chunk = sock.recv(2**20)  
-                if not chunk:
-                    break
-                data_received += chunk
-                
-                if end_marker in data_received[-8:]:  
-                    break
-            
-            
-            response_str = data_received.decode()
-            response_str = response_str.strip()
-            
-            return json.loads(response_str)
+        response_str = connection_pool.request(server_address, exchange).decode().strip()
+        return json.loads(response_str)
     except Exception as e:
         print(f"Error: {e}")
         return {"status": "ERROR", "message": str(e)}
 
+def send_binary_command(command_str, payload=None):
+    def exchange(sock):
+        sock.sendall(command_str.encode())
+        if payload:
+            sock.sendall(payload)
+        status, name, data, _ = read_frame(sock)
+        return status, name, data
+
+    try:
+        return connection_pool.request(server_address, exchange)
+    except Exception as e:
+        print(f"Error: {e}")
+        return STATUS_ERROR, "", str(e).encode()
+
 def remote_list():
     command_str = "LIST\r\n\r\n"
     hasil = send_command(command_str)
@@ -109,6 +115,49 @@ def remote_add(filename=""):
         print(f"Gagal: {result.get('data', 'Unknown error')}")
         return False, "Gagal"
     
+def remote_bget(filename=""):
+    print(f"Sending BGET request for {filename}...")
+
+    start_time = time.time()
+    status, namafile, isifile = send_binary_command(f"BGET {filename}\r\n\r\n")
+    end_time = time.time()
+
+    print(f"Response received in {end_time - start_time:.2f} seconds")
+
+    if status == STATUS_OK:
+        print(f"Writing {len(isifile)} bytes to file...")
+        with open(namafile, 'wb') as fp:
+            fp.write(isifile)
+
+        print(f"File {filename} berhasil didownload ({len(isifile)} bytes)")
+        return True, "Success"
+    else:
+        print(f"Gagal: {bytes(isifile).decode(errors='replace')}")
+        return False, "Gagal"
+
+def remote_bput(filename=""):
+    if not os.path.exists(filename):
+        print(f"File {filename} tidak ditemukan...")
+        return False, "File tidak ditemukan"
+
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    print(f"Sending BPUT request ({len(content)} bytes)...")
+
+    start_time = time.time()
+    status, _, message = send_binary_command(f"BPUT {filename} {len(content)}\r\n\r\n", content)
+    end_time = time.time()
+
+    print(f"Response received in {end_time - start_time:.2f} seconds")
+
+    if status == STATUS_OK:
+        print(f"File {filename} berhasil diupload")
+        return True, "Success"
+    else:
+        print(f"Gagal: {bytes(message).decode(errors='replace')}")
+        return False, "Gagal"
+
 def remote_delete(filename=""):
     command_str = f"DELETE {filename}\r\n\r\n"
     hasil = send_command(command_str)
@@ -126,6 +175,11 @@ def stress_worker(task_type, filename):
     if task_type == "upload":
         success, res = remote_add(filename)
         print(f"----> Uploading {filename} completed")
+    elif task_type == "upload_binary":
+        success, res = remote_bput(filename)
+        print(f"----> Uploading {filename} completed")
+    elif task_type == "download_binary":
+        success, res = remote_bget(filename)
     else:
         success, res = remote_get(filename)
     end = time.time()
@@ -188,7 +242,7 @@ def main():
     
     combinations = [
         (t, f, p, c)
-        for t in ["download", "upload"]
+        for t in ["download", "upload", "download_binary", "upload_binary"]
         for f in ["1B.bin", "1KB.bin", "100KB.bin", "1MB.bin", "10MB.bin", "100MB.bin"]  
         for p in ["thread"]
         for c in [1]
@@ -0,0 +1,140 @@
+import base64
+import lzma
+import os
+import time
+import zlib
+
+from file_trace import phase
+
+COMPRESSIONS = ('zlib', 'lzma')
+IDENTITY = 'identity'
+
+ZLIB_LEVEL = 6
+# Higher LZMA presets compress a little better but are several times slower
+LZMA_PRESET = 1
+
+# Already compressed formats: compressing them again only costs CPU
+COMPRESSED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.zip',
+                         '.gz', '.tgz', '.bz2', '.xz', '.7z', '.zst', '.pdf')
+
+# A sample of this size must shrink by at least MIN_SAVING for a file to be compressed
+SAMPLE_SIZE = 2**16
+MIN_SAVING = 0.1
+
+
+def is_compressible(filename, sample):
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - MIN_SAVING)
+
+
+def choose_encoding(filename, fileobj, requested):
+    """
+    The encoding actually used for a download: `requested`, or IDENTITY when the
+    file type or a sample from the start of `fileobj` shows compression will not pay off.
+    """
+    if requested == IDENTITY:
+        return IDENTITY
+    sample = os.pread(fileobj.fileno(), SAMPLE_SIZE, 0)
+    return requested if is_compressible(filename, sample) else IDENTITY
+
+
+class Compressor:
+    # Streaming compressor that also tracks the CPU time spent compressing
+    def __init__(self, encoding):
+        if encoding == 'zlib':
+            self.engine = zlib.compressobj(ZLIB_LEVEL)
+        elif encoding == 'lzma':
+            self.engine = lzma.LZMACompressor(preset=LZMA_PRESET)
+        else:
+            raise ValueError(f"Kompresi {encoding} tidak dikenal")
+        self.size = 0
+        self.cpu_time = 0.0
+
+    def compress(self, data):
+        start = time.thread_time()
+        out = self.engine.compress(data)
+        self.cpu_time += time.thread_time() - start
+        self.size += len(out)
+        return out
+
+    def flush(self):
+        start = time.thread_time()
+        out = self.engine.flush()
+        self.cpu_time += time.thread_time() - start
+        self.size += len(out)
+        return out
+
+
+class Decompressor:
+    """
+    Streaming decompressor. Output is produced in pieces of at most `max_length`
+    bytes, so a small, highly compressed input cannot expand in memory all at once.
+    Like Compressor it tracks the CPU time spent decompressing.
+    """
+
+    def __init__(self, encoding, max_length=2**20):
+        if encoding == 'zlib':
+            self.engine = zlib.decompressobj()
+            self.error = zlib.error
+        elif encoding == 'lzma':
+            self.engine = lzma.LZMADecompressor()
+            self.error = lzma.LZMAError
+        else:
+            raise ValueError(f"Kompresi {encoding} tidak dikenal")
+        self.encoding = encoding
+        self.max_length = max_length
+        self.cpu_time = 0.0
+
+    def _decompress(self, data):
+        start = time.thread_time()
+        out = self.engine.decompress(data, self.max_length)
+        self.cpu_time += time.thread_time() - start
+        return out
+
+    def decompress(self, data):
+        # Raises zlib.error/lzma.LZMAError (self.error) for bytes after the end of the stream
+        if self.engine.eof and data:
+            raise self.error("Data after the end of the compressed stream")
+        if self.encoding == 'zlib':
+            out = self._decompress(data)
+            while out:
+                yield out
+                out = self._decompress(self.engine.unconsumed_tail)
+        else:
+            out = self._decompress(data)
+            while out:
+                yield out
+                if self.engine.eof or self.engine.needs_input:
+                    break
+                out = self._decompress(b'')
+        if self.engine.eof and self.engine.unused_data:
+            raise self.error("Data after the end of the compressed stream")
+
+    def finish(self):
+        # True if the compressed stream was complete, with nothing after it
+        return self.engine.eof and not self.engine.unused_data
+
+
+def iter_compressed(chunks, compressor):
+    for chunk in chunks:
+        with phase('compress'):
+            out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def iter_base64_stream(chunks):
+    # base64 of a byte stream whose pieces are not multiples of 3 bytes long
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk if carry else chunk
+        usable = len(data) - len(data) % 3
+        carry = data[usable:]
+        if usable:
+            yield base64.b64encode(data[:usable])
+    if carry:
+        yield base64.b64encode(carry)
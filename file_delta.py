@@ -0,0 +1,127 @@
+import hashlib
+import math
+import os
+import struct
+import zlib
+
+# Instructions of a BDELTA payload, applied in order to build the new file:
+#   COPY     b'C' offset length   copy `length` bytes at `offset` of the current server file
+#   LITERAL  b'L' length <bytes>  bytes that are not in the server file
+OP_COPY = struct.Struct('!cQQ')
+OP_LITERAL = struct.Struct('!cQ')
+COPY = b'C'
+LITERAL = b'L'
+
+MIN_BLOCK_SIZE = 2**11
+MAX_BLOCK_SIZE = 2**16
+ADLER_MOD = 65521
+
+
+def block_size_for(size):
+    # About sqrt(size) bytes per block, like rsync: fewer signatures for big files,
+    # smaller literals for small ones
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, math.isqrt(size) // 1024 * 1024))
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def block_signatures(fd, block_size):
+    # [weak, strong] per block of an open file: adler32 (rolls cheaply) and blake2b (confirms a match)
+    signatures = []
+    offset = 0
+    while True:
+        block = os.pread(fd, block_size, offset)
+        if not block:
+            return signatures
+        signatures.append([zlib.adler32(block), strong_hash(block)])
+        offset += len(block)
+
+
+def compute_delta(data, signatures, block_size, base_size, max_literal=None):
+    """
+    Instructions that turn the server file described by `signatures` into `data`
+    (bytes or an mmap): a list of (COPY, base offset, length) and (LITERAL, offset
+    in data, length), with adjacent copies merged.
+
+    Unchanged stretches are matched a block at a time. After a mismatch the weak
+    checksum rolls one byte at a time, so inserted or removed bytes only cost the
+    blocks around them. Returns None once more than `max_literal` bytes would have
+    to be sent, when a full upload is the better choice.
+    """
+    tail_size = base_size - (len(signatures) - 1) * block_size if signatures else 0
+    weak_index = {}
+    for i, (weak, _) in enumerate(signatures):
+        if i < len(signatures) - 1 or tail_size == block_size:
+            weak_index.setdefault(weak, []).append(i)
+
+    ops = []
+    literal_total = 0
+
+    def add_literal(start, end):
+        nonlocal literal_total
+        if end > start:
+            ops.append((LITERAL, start, end - start))
+            literal_total += end - start
+
+    def add_copy(offset, length):
+        if ops and ops[-1][0] == COPY and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = (COPY, ops[-1][1], ops[-1][2] + length)
+        else:
+            ops.append((COPY, offset, length))
+
+    n = len(data)
+    pos = literal_start = 0
+    a = b = None
+    # Without full blocks on the server there is nothing to roll for
+    while weak_index and pos + block_size <= n:
+        if a is None:
+            checksum = zlib.adler32(data[pos:pos + block_size])
+            a, b = checksum & 0xffff, checksum >> 16
+        candidates = weak_index.get((b << 16) | a)
+        if candidates:
+            strong = strong_hash(data[pos:pos + block_size])
+            match = next((i for i in candidates if signatures[i][1] == strong), None)
+            if match is not None:
+                add_literal(literal_start, pos)
+                add_copy(match * block_size, block_size)
+                pos += block_size
+                literal_start = pos
+                a = None
+                continue
+        if max_literal is not None and literal_total + pos - literal_start > max_literal:
+            return None
+        if pos + block_size < n:
+            out, new = data[pos], data[pos + block_size]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block_size * out + a - 1) % ADLER_MOD
+        pos += 1
+
+    # The server file's last block is usually shorter and can only match at the very end
+    tail_start = n - tail_size
+    if 0 < tail_size < block_size and tail_start >= literal_start:
+        tail = data[tail_start:]
+        weak, strong = signatures[-1]
+        if zlib.adler32(tail) == weak and strong_hash(tail) == strong:
+            add_literal(literal_start, tail_start)
+            add_copy(base_size - tail_size, tail_size)
+            literal_start = n
+    add_literal(literal_start, n)
+    if max_literal is not None and literal_total > max_literal:
+        return None
+    return ops
+
+
+def delta_length(ops):
+    return sum(OP_COPY.size if op == COPY else OP_LITERAL.size + length for op, _, length in ops)
+
+
+def iter_delta(ops, data):
+    # The BDELTA payload for `ops`, with literal bytes taken from `data`
+    for op, offset, length in ops:
+        if op == COPY:
+            yield OP_COPY.pack(COPY, offset, length)
+        else:
+            yield OP_LITERAL.pack(LITERAL, length)
+            yield data[offset:offset + length]
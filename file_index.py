@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Directory mtimes have coarse granularity, so a change made in the same clock tick as
+# a scan can leave the mtime unchanged. Until the directory mtime is this much older
+# than the last scan, the index is rebuilt instead of trusted.
+MTIME_SLACK_NS = 1_000_000_000
+
+
+class DirectoryIndex:
+    """
+    In-memory index of the files in a directory: name -> (size, mtime_ns, type).
+
+    add/delete keep it current through update()/remove(); changes made by other
+    processes are picked up by comparing the directory mtime on each read, which
+    costs a single stat() instead of a directory walk.
+    """
+
+    def __init__(self, path='.'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.image_names = {}
+        self.dir_mtime = None
+        self.scanned_at = 0
+
+    @staticmethod
+    def visible(name):
+        # Same selection as glob('*.*'): hidden files (upload temp files, sessions, the
+        # content store) are skipped, and so is anything below the top directory
+        return '.' in name and not name.startswith('.') and '/' not in name
+
+    @staticmethod
+    def file_type(name):
+        ext = os.path.splitext(name)[1].lower()
+        return 'image' if ext in IMAGE_EXTENSIONS else ext.lstrip('.')
+
+    def list(self):
+        with self.lock:
+            self._revalidate()
+            return list(self.entries)
+
+    def images(self):
+        with self.lock:
+            self._revalidate()
+            return list(self.image_names)
+
+    def get(self, name):
+        with self.lock:
+            self._revalidate()
+            return self.entries.get(name)
+
+    def get_many(self, names):
+        # One revalidation for a whole batch instead of one per name
+        with self.lock:
+            self._revalidate()
+            return [self.entries.get(name) for name in names]
+
+    def update(self, name):
+        if not self.visible(name):
+            return
+        try:
+            st = os.stat(os.path.join(self.path, name))
+        except FileNotFoundError:
+            self.remove(name)
+            return
+        with self.lock:
+            self._set(name, st)
+
+    def remove(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+            self.image_names.pop(name, None)
+
+    def _set(self, name, st):
+        file_type = self.file_type(name)
+        self.entries[name] = (st.st_size, st.st_mtime_ns, file_type)
+        if file_type == 'image':
+            self.image_names[name] = True
+
+    def _revalidate(self):
+        dir_mtime = os.stat(self.path).st_mtime_ns
+        if dir_mtime == self.dir_mtime and dir_mtime < self.scanned_at - MTIME_SLACK_NS:
+            return
+
+        scanned_at = time.time_ns()
+        self.entries = {}
+        self.image_names = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if self.visible(entry.name) and entry.is_file():
+                    self._set(entry.name, entry.stat())
+        self.dir_mtime = dir_mtime
+        self.scanned_at = scanned_at
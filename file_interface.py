@@ -1,8 +1,172 @@
 import os
 import json
 import base64
-from glob import glob
+import binascii
+import hashlib
+import uuid
 import logging
+import lzma
+import zlib
+
+from file_cache import ResponseCache, SingleFlight
+from file_compress import IDENTITY, Decompressor, iter_compressed, iter_base64_stream
+from file_delta import COPY, LITERAL, OP_COPY, OP_LITERAL, block_signatures, block_size_for
+from file_index import DirectoryIndex
+from file_session import UploadSession
+from file_store import DIGEST, ContentStore, fd_digest, reserved
+from file_trace import phase
+
+
+class UploadWriter:
+    # Writes an upload to a hidden temp file while it is still arriving and
+    # renames it into place on commit. Base64 input is decoded per chunk, and
+    # compressed uploads (ZADD) are decompressed per chunk after that.
+    # The content is hashed as it is written, for the deduplicating store.
+    def __init__(self, filename, encoding='raw', compression=None, store=None):
+        self.filename = filename
+        self.store = store
+        self.digest = hashlib.sha256()
+        self.encoding = encoding
+        self.decompressor = Decompressor(compression) if compression not in (None, IDENTITY) else None
+        self.temp_path = f".upload-{uuid.uuid4().hex}.tmp"
+        self.file = open(self.temp_path, 'wb')
+        self.tail = b''
+        self.size = 0
+        self.received = 0
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        if self.encoding == 'base64':
+            if self.tail:
+                data = self.tail + data
+            usable = len(data) - len(data) % 4
+            self.tail = bytes(data[usable:])
+            try:
+                with phase('base64'):
+                    data = base64.b64decode(data[:usable])
+            except (binascii.Error, ValueError) as e:
+                self.error = f"Base64 decoding error: {str(e)}"
+                return
+        self._store(data)
+
+    def _store(self, data):
+        self.received += len(data)
+        if self.decompressor is None:
+            self._write(data)
+            return
+        try:
+            pieces = self.decompressor.decompress(data)
+            while True:
+                with phase('decompress'):
+                    piece = next(pieces, None)
+                if piece is None:
+                    break
+                self._write(piece)
+        except (zlib.error, lzma.LZMAError) as e:
+            self.error = f"Decompression error: {str(e)}"
+
+    def _write(self, data):
+        with phase('disk_write'):
+            self.file.write(data)
+        with phase('hash'):
+            self.digest.update(data)
+        self.size += len(data)
+
+    def commit(self):
+        if self.tail and self.error is None:
+            try:
+                self._store(base64.b64decode(self.tail))
+            except (binascii.Error, ValueError) as e:
+                self.error = f"Base64 decoding error: {str(e)}"
+        if self.error is None and self.decompressor is not None and not self.decompressor.finish():
+            self.error = "Compressed data is incomplete"
+        self.file.close()
+        if self.error is not None:
+            os.remove(self.temp_path)
+            return False
+        if self.store is None:
+            os.replace(self.temp_path, self.filename)
+        else:
+            self.store.publish(self.temp_path, self.filename, self.digest.hexdigest())
+        return True
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class DeltaWriter(UploadWriter):
+    # Builds a new version of a file from a BDELTA instruction stream: COPY ranges are read
+    # from the current version (kept open from the start), LITERAL bytes come from the stream
+    def __init__(self, filename, base, target_digest, store=None):
+        super().__init__(filename, 'raw', None, store)
+        self.base = base
+        self.base_size = os.fstat(base.fileno()).st_size
+        self.target_digest = target_digest
+        self.pending = b''
+        self.literal_left = 0
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        if self.pending:
+            data = self.pending + bytes(data)
+            self.pending = b''
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view) and self.error is None:
+            if self.literal_left:
+                piece = view[pos:pos + self.literal_left]
+                self._store(piece)
+                self.literal_left -= len(piece)
+                pos += len(piece)
+                continue
+            op = view[pos:pos + 1].tobytes()
+            if op == COPY:
+                if len(view) - pos < OP_COPY.size:
+                    break
+                _, offset, length = OP_COPY.unpack_from(view, pos)
+                pos += OP_COPY.size
+                self._copy(offset, length)
+            elif op == LITERAL:
+                if len(view) - pos < OP_LITERAL.size:
+                    break
+                _, self.literal_left = OP_LITERAL.unpack_from(view, pos)
+                pos += OP_LITERAL.size
+            else:
+                self.error = f"Invalid delta instruction {op!r}"
+        self.pending = bytes(view[pos:])
+
+    def _copy(self, offset, length, chunk_size=2**20):
+        if offset + length > self.base_size:
+            self.error = f"Copy of {length} bytes at {offset} is beyond the end of {self.filename}"
+            return
+        fd = self.base.fileno()
+        end = offset + length
+        while offset < end:
+            with phase('disk_read'):
+                chunk = os.pread(fd, min(chunk_size, end - offset), offset)
+            if not chunk:
+                self.error = f"{self.filename} is shorter than expected"
+                return
+            self._store(chunk)
+            offset += len(chunk)
+
+    def commit(self):
+        self.base.close()
+        if self.error is None and (self.literal_left or self.pending):
+            self.error = "Delta is incomplete"
+        if self.error is None and self.digest.hexdigest() != self.target_digest:
+            self.error = "Reconstructed file does not match the target digest"
+        return super().commit()
+
+    def abort(self):
+        self.base.close()
+        super().abort()
+
 
 class FileInterface:
     def __init__(self):
@@ -10,16 +174,34 @@ class FileInterface:
         if not os.path.exists('uploads'):
             os.makedirs('uploads')
         os.chdir('uploads/')
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        # LIST and IMAGE are answered from this index instead of walking the directory
+        self.index = DirectoryIndex('.')
+        # Encoded GET responses, invalidated whenever a file is written or deleted
+        self.response_cache = ResponseCache()
+        # Concurrent GETs of the same file version share one read + encode
+        self.get_flight = SingleFlight()
+        # ETag of each file version, keyed like the response cache, so files are not rehashed per GET
+        self.validators = ResponseCache(max_bytes=2**20)
+        # Concurrent first GETs of a file version share one sha256 of it
+        self.etag_flight = SingleFlight()
+        # Uploaded content is stored once per distinct sha256, names are hard links to it
+        self.store = ContentStore()
 
     def list(self, params=[]):
         try:
-            filelist = glob('*.*')
+            filelist = self.index.list()
             return dict(status='OK', data=filelist)
         except Exception as e:
             logging.error(f"Error listing files: {str(e)}")
             return dict(status='ERROR', data=str(e))
 
+    def image(self, params=[]):
+        try:
+            return dict(status='OK', data=self.index.images())
+        except Exception as e:
+            logging.error(f"Error listing images: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
     def get(self, params=[]):
         try:
             if not params or len(params) == 0:
@@ -27,27 +209,29 @@ class FileInterface:
                 return dict(status='ERROR', data="No filename provided")
                 
             filename = params[0]
-            logging.info(f"GET request for file: {filename}")
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
+            logging.info("GET request for file: %s", filename)
             
             if not os.path.exists(filename):
                 logging.error(f"File {filename} not found")
                 return dict(status='ERROR', data=f"File {filename} not found")
                 
-            logging.info(f"Reading file {filename} for GET request")
+            logging.info("Reading file %s for GET request", filename)
             file_size = os.path.getsize(filename)
             
             # For very large files, read in chunks
             if file_size > 10 * 1024 * 1024:  # If file is larger than 10MB
-                logging.info(f"Large file detected ({file_size} bytes), reading in chunks")
+                logging.info("Large file detected (%s bytes), reading in chunks", file_size)
                 
                 try:
                     # Read file in chunks and encode each chunk
                     with open(filename, 'rb') as fp:
                         content = fp.read()
                     
-                    logging.info(f"Successfully read all {file_size} bytes")
+                    logging.info("Successfully read all %s bytes", file_size)
                     encoded_content = base64.b64encode(content).decode()
-                    logging.info(f"Successfully encoded content, encoded size: {len(encoded_content)} bytes")
+                    logging.info("Successfully encoded content, encoded size: %s bytes", len(encoded_content))
                     
                     return dict(status='OK', data_namafile=filename, data_file=encoded_content)
                     
@@ -61,12 +245,12 @@ class FileInterface:
                         file_content = fp.read()
                     
                     file_size = len(file_content)
-                    logging.info(f"File read successfully, size: {file_size} bytes")
+                    logging.info("File read successfully, size: %s bytes", file_size)
                     
-                    logging.info(f"Encoding file {filename}")
+                    logging.info("Encoding file %s", filename)
                     encoded_content = base64.b64encode(file_content).decode()
                     encoded_size = len(encoded_content)
-                    logging.info(f"Encoded size: {encoded_size} bytes")
+                    logging.info("Encoded size: %s bytes", encoded_size)
                     
                     return dict(status='OK', data_namafile=filename, data_file=encoded_content)
                     
@@ -83,53 +267,433 @@ class FileInterface:
                 return dict(status='ERROR', data="Parameter tidak lengkap")
 
             filename = params[0]
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
             encoded_content = params[1]
             
-            logging.info(f"Receiving file {filename}")
-            logging.info(f"Encoded content size: {len(encoded_content)} bytes")
+            logging.info("Receiving file %s", filename)
+            logging.info("Encoded content size: %s bytes", len(encoded_content))
             
-            logging.info(f"Decoding file {filename}")
+            logging.info("Decoding file %s", filename)
             try:
                 file_content = base64.b64decode(encoded_content)
             except Exception as e:
                 logging.error(f"Base64 decoding error: {str(e)}")
                 return dict(status='ERROR', data=f"Base64 decoding error: {str(e)}")
                 
-            logging.info(f"Writing {len(file_content)} bytes to {filename}")
+            logging.info("Writing %s bytes to %s", len(file_content), filename)
             
-            with open(filename, 'wb') as file:
+            # Never written in place: the name may share its content with other names
+            temp_path = f".upload-{uuid.uuid4().hex}.tmp"
+            with open(temp_path, 'wb') as file:
                 file.write(file_content)
-            
-            if os.path.exists(filename):
-                file_size = os.path.getsize(filename)
-                logging.info(f"File {filename} successfully written ({file_size} bytes)")
-                return dict(status='OK', data=f"File {filename} berhasil diupload ({file_size} bytes)")
-            else:
-                logging.error(f"File {filename} failed to write")
-                return dict(status='ERROR', data=f"File {filename} gagal diupload")
-            
+            self.store.publish(temp_path, filename, hashlib.sha256(file_content).hexdigest())
+
+            # The size comes from what was written: a pipelined DELETE may already have removed the name
+            self.index.update(filename)
+            self.response_cache.invalidate(filename)
+            file_size = len(file_content)
+            logging.info("File %s successfully written (%s bytes)", filename, file_size)
+            return dict(status='OK', data=f"File {filename} berhasil diupload ({file_size} bytes)")
+
         except Exception as e:
             logging.error(f"Error in ADD operation: {str(e)}")
             return dict(status='ERROR', data=str(e))
     
+    def zadd(self, params=[]):
+        # Non-streamed ZADD (e.g. pipelined): params = [filename, compression, base64 content]
+        try:
+            if not params or len(params) < 3:
+                return dict(status='ERROR', data="Parameter tidak lengkap")
+
+            result = self.begin_upload([params[0], 'base64', params[1]])
+            if result['status'] != 'OK':
+                return result
+            writer = result['data_file']
+            writer.write(params[2].encode())
+            return self.commit_upload([writer])
+        except Exception as e:
+            logging.error(f"Error in ZADD operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def stream_get(self, params=[]):
+        # Opens the file for a streamed GET; the caller encodes it with iter_base64()
+        # (or answers from the response cache, keyed by data_key) and closes data_file
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No filename provided")
+
+            filename = params[0]
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
+            if not os.path.isfile(filename):
+                logging.error(f"File {filename} not found")
+                return dict(status='ERROR', data=f"File {filename} not found")
+
+            fp = open(filename, 'rb')
+            st = os.fstat(fp.fileno())
+            logging.info("Streaming GET %s (%s bytes)", filename, st.st_size)
+            return dict(status='OK', data_namafile=filename, data_size=st.st_size,
+                        data_key=(filename, st.st_size, st.st_mtime_ns, st.st_ino), data_file=fp)
+        except Exception as e:
+            logging.error(f"Error in streaming GET operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def etag(self, result):
+        # Validator for an open stream_get() result: the sha256 of the file, read from the
+        # content store when the file is stored there and hashed once per version otherwise
+        key = result['data_key']
+        etag = self.validators.get(key)
+        if etag is not None:
+            return etag
+        fd = result['data_file'].fileno()
+
+        def compute():
+            digest = self.store.digest(os.fstat(fd)) or fd_digest(fd)
+            self.validators.put(key, digest)
+            return digest
+
+        # Only the first request for this version hashes it; concurrent ones wait and share the digest
+        return self.etag_flight.do(key, compute)
+
+    def sigs(self, params=[]):
+        # Block signatures for a delta upload: params = [filename] or [filename, block size]
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No filename provided")
+            block_size = None
+            if len(params) > 1:
+                try:
+                    block_size = int(params[1])
+                except ValueError:
+                    return dict(status='ERROR', data="Block size must be an integer")
+                if block_size <= 0:
+                    return dict(status='ERROR', data="Block size must be positive")
+
+            result = self.stream_get(params[:1])
+            if result['status'] != 'OK':
+                return result
+            with result['data_file'] as fileobj:
+                if block_size is None:
+                    block_size = block_size_for(result['data_size'])
+                etag = self.etag(result)
+                signatures = block_signatures(fileobj.fileno(), block_size)
+            logging.info("Signatures of %s: %s blocks of %s bytes", result['data_namafile'], len(signatures),
+                         block_size)
+            return dict(status='OK', data_namafile=result['data_namafile'], size=result['data_size'], etag=etag,
+                        block_size=block_size, signatures=signatures)
+        except Exception as e:
+            logging.error(f"Error in SIGS operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def begin_delta(self, params=[]):
+        # params = [filename, etag of the version the delta was made against, sha256 of the result]
+        try:
+            if not params or len(params) < 3:
+                return dict(status='ERROR', data="BDELTA requires filename, base etag and target digest")
+
+            filename, base_etag, target_digest = params[0], params[1].lower(), params[2].lower()
+            if not DIGEST.fullmatch(target_digest):
+                return dict(status='ERROR', data=f"Invalid digest {target_digest}")
+            result = self.stream_get([filename])
+            if result['status'] != 'OK':
+                return result
+            if self.etag(result) != base_etag:
+                result['data_file'].close()
+                return dict(status='ERROR', data=f"File {filename} has changed since SIGS, request new signatures")
+            logging.info("Receiving delta for %s against %s", filename, base_etag)
+            return dict(status='OK', data_namafile=filename,
+                        data_file=DeltaWriter(filename, result['data_file'], target_digest, self.store))
+        except Exception as e:
+            logging.error(f"Error starting delta upload: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def stream_range(self, params=[]):
+        # Byte range of a file, params = [filename, offset, length]; a length of None
+        # reads to the end of the file. The file is left open at the range start.
+        try:
+            if not params or len(params) < 2:
+                return dict(status='ERROR', data="Filename and offset required")
+
+            filename, offset = params[0], params[1]
+            length = params[2] if len(params) > 2 else None
+            result = self.stream_get([filename])
+            if result['status'] != 'OK':
+                return result
+
+            file_size = result['data_size']
+            if offset > file_size:
+                result['data_file'].close()
+                return dict(status='ERROR', data=f"Offset {offset} beyond end of {filename} ({file_size} bytes)")
+
+            count = file_size - offset if length is None else min(length, file_size - offset)
+            result['data_file'].seek(offset)
+            result.update(data_offset=offset, data_length=count, data_mtime=result['data_key'][2])
+            return result
+        except Exception as e:
+            logging.error(f"Error in RANGE operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def iter_base64(self, fp, chunk_size=3 * 2**16, count=None):
+        # Same content as get(), but base64 is produced chunk by chunk so memory stays constant.
+        # chunk_size must be a multiple of 3 so the encoded chunks concatenate cleanly.
+        # Reads from the current position, up to `count` bytes if given.
+        with fp:
+            remaining = count
+            while remaining is None or remaining > 0:
+                with phase('disk_read'):
+                    chunk = fp.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                with phase('base64'):
+                    encoded = base64.b64encode(chunk)
+                yield encoded
+
+    def iter_compressed_base64(self, fp, compressor, chunk_size=2**16):
+        # Compressed file content as base64 pieces, read and compressed chunk by chunk
+        with fp:
+            chunks = iter(lambda: fp.read(chunk_size), b'')
+            yield from iter_base64_stream(iter_compressed(chunks, compressor))
+
+    def begin_upload(self, params=[]):
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No filename provided")
+
+            filename = params[0]
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
+            encoding = params[1] if len(params) > 1 else 'raw'
+            compression = params[2] if len(params) > 2 else None
+            logging.info("Receiving file %s (%s%s)", filename, encoding,
+                         ', ' + compression if compression else '')
+            return dict(status='OK', data_namafile=filename,
+                        data_file=UploadWriter(filename, encoding, compression, self.store))
+        except Exception as e:
+            logging.error(f"Error starting upload: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def commit_upload(self, params=[]):
+        try:
+            writer = params[0]
+            if not writer.commit():
+                logging.error(f"Upload of {writer.filename} failed: {writer.error}")
+                return dict(status='ERROR', data=writer.error)
+
+            self.index.update(writer.filename)
+            self.response_cache.invalidate(writer.filename)
+            file_size = writer.size
+            logging.info("File %s successfully written (%s bytes)", writer.filename, file_size)
+            result = dict(status='OK', data=f"File {writer.filename} berhasil diupload ({file_size} bytes)")
+            if writer.decompressor is not None:
+                # ZADD reports its decompression cost, as ZGET does for compression
+                result['cpu_time'] = round(writer.decompressor.cpu_time, 4)
+            return result
+        except Exception as e:
+            logging.error(f"Error finishing upload: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def stat(self, params=[]):
+        # Batch metadata lookup: params = list of filenames, one result per name
+        try:
+            if not params:
+                return dict(status='ERROR', data="No filename provided")
+
+            items = []
+            for filename, entry in zip(params, self.index.get_many(params)):
+                if entry is None and not reserved(filename) and os.path.isfile(filename):
+                    # Not listed by the index (e.g. a name without an extension) but still servable
+                    st = os.stat(filename)
+                    entry = (st.st_size, st.st_mtime_ns, DirectoryIndex.file_type(filename))
+                if entry is None:
+                    items.append(dict(status='ERROR', data_namafile=filename, data=f"File {filename} not found"))
+                else:
+                    size, mtime_ns, file_type = entry
+                    items.append(dict(status='OK', data_namafile=filename, size=size, mtime_ns=mtime_ns,
+                                      type=file_type))
+            return dict(status='OK', data=items)
+        except Exception as e:
+            logging.error(f"Error in STAT operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def mdelete(self, params=[]):
+        # Batch delete: params = list of filenames, one result per name
+        try:
+            if not params:
+                return dict(status='ERROR', data="No filename provided")
+
+            items = []
+            for filename in params:
+                result = self.delete([filename])
+                result['data_namafile'] = filename
+                items.append(result)
+            deleted = sum(1 for item in items if item['status'] == 'OK')
+            logging.info("Batch DELETE removed %s of %s files", deleted, len(params))
+            return dict(status='OK', data=items)
+        except Exception as e:
+            logging.error(f"Error in MDELETE operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def has(self, params=[]):
+        # Which of the given sha256 digests the store already holds: params = list of digests
+        try:
+            if not params:
+                return dict(status='ERROR', data="No digest provided")
+
+            items = []
+            for digest in params:
+                digest = digest.lower()
+                if not DIGEST.fullmatch(digest):
+                    items.append(dict(status='ERROR', data_hash=digest, data=f"Invalid digest {digest}"))
+                    continue
+                size = self.store.lookup(digest)
+                items.append(dict(status='OK', data_hash=digest, present=size is not None, size=size))
+            return dict(status='OK', data=items)
+        except Exception as e:
+            logging.error(f"Error in HAS operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def link(self, params=[]):
+        # Creates a file from content the store already holds: params = [filename, digest]
+        try:
+            if not params or len(params) < 2:
+                return dict(status='ERROR', data="LINK requires filename and digest")
+
+            filename, digest = params[0], params[1].lower()
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
+            size = self.store.link(digest, filename)
+            self.index.update(filename)
+            self.response_cache.invalidate(filename)
+            logging.info("File %s linked to stored content %s (%s bytes)", filename, digest, size)
+            return dict(status='OK', data=f"File {filename} berhasil diupload ({size} bytes)")
+        except Exception as e:
+            logging.error(f"Error in LINK operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def ustart(self, params=[]):
+        # Resumable upload: params = [filename, total size, chunk size]
+        try:
+            if not params or len(params) < 3:
+                return dict(status='ERROR', data="USTART requires filename, size and chunk size")
+            if reserved(params[0]):
+                return dict(status='ERROR', data=f"Invalid filename {params[0]}")
+            try:
+                size, chunk_size = int(params[1]), int(params[2])
+            except ValueError:
+                return dict(status='ERROR', data="Size and chunk size must be integers")
+
+            self._expire_sessions()
+            session = UploadSession.create(params[0], size, chunk_size)
+            logging.info("Upload session %s started for %s (%s bytes, %s chunks)",
+                         session.session_id, session.filename, size, session.chunks)
+            return dict(status='OK', data_session=session.session_id, data_namafile=session.filename,
+                        size=size, chunk_size=chunk_size, chunks=session.chunks)
+        except Exception as e:
+            logging.error(f"Error starting upload session: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def ustatus(self, params=[]):
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No session provided")
+
+            self._expire_sessions()
+            session = UploadSession.open(params[0])
+            present = session.present()
+            missing = sorted(set(range(session.chunks)) - set(present))
+            return dict(status='OK', data_session=session.session_id, data_namafile=session.filename,
+                        size=session.size, chunk_size=session.chunk_size, chunks=session.chunks,
+                        present=present, missing=missing)
+        except Exception as e:
+            logging.error(f"Error in USTATUS operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def _expire_sessions(self):
+        # Abandoned sessions (never committed or aborted) are cleaned up as new ones start or are polled
+        for session_id in UploadSession.expire():
+            logging.info("Upload session %s expired", session_id)
+
+    def ucommit(self, params=[]):
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No session provided")
+
+            session = UploadSession.open(params[0])
+            missing = session.commit(self.store.publish)
+            if missing:
+                return dict(status='ERROR', data=f"Upload {session.filename} belum lengkap, "
+                                                 f"{len(missing)} chunk belum diterima", missing=missing)
+
+            self.index.update(session.filename)
+            self.response_cache.invalidate(session.filename)
+            logging.info("Upload session %s committed to %s (%s bytes)",
+                         session.session_id, session.filename, session.size)
+            return dict(status='OK', data=f"File {session.filename} berhasil diupload ({session.size} bytes)")
+        except Exception as e:
+            logging.error(f"Error in UCOMMIT operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def uabort(self, params=[]):
+        try:
+            if not params or len(params) == 0:
+                return dict(status='ERROR', data="No session provided")
+
+            session = UploadSession.open(params[0])
+            session.remove()
+            return dict(status='OK', data=f"Upload session {session.session_id} dibatalkan")
+        except Exception as e:
+            logging.error(f"Error in UABORT operation: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def begin_chunk(self, params=[]):
+        # params = [session id, chunk index]; returns a ChunkWriter for the chunk's bytes
+        try:
+            if not params or len(params) < 2:
+                return dict(status='ERROR', data="Session and chunk index required")
+
+            session = UploadSession.open(params[0])
+            writer = session.chunk_writer(int(params[1]))
+            return dict(status='OK', data_namafile=session.filename, data_file=writer)
+        except Exception as e:
+            logging.error(f"Error starting chunk upload: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
+    def commit_chunk(self, params=[]):
+        try:
+            writer = params[0]
+            if not writer.commit():
+                logging.error(f"Chunk {writer.index} of session {writer.session.session_id} failed: {writer.error}")
+                return dict(status='ERROR', data=writer.error)
+            return dict(status='OK', data=f"Chunk {writer.index} diterima ({writer.size} bytes)")
+        except Exception as e:
+            logging.error(f"Error finishing chunk upload: {str(e)}")
+            return dict(status='ERROR', data=str(e))
+
     def delete(self, params=[]):
         try:
             if not params or len(params) == 0:
                 return dict(status='ERROR', data="No filename provided")
                 
             filename = params[0]
+            if reserved(filename):
+                return dict(status='ERROR', data=f"Invalid filename {filename}")
             
             if not os.path.exists(filename):
                 return dict(status='ERROR', data=f"File {filename} not found")
             
-            logging.info(f"Deleting file {filename}")
-            os.remove(filename)
+            logging.info("Deleting file %s", filename)
+            self.store.remove(filename)
+            self.index.remove(filename)
+            self.response_cache.invalidate(filename)
             
             if os.path.exists(filename):
                 logging.error(f"Failed to delete {filename}")
                 return dict(status='ERROR', data=f"File {filename} gagal dihapus")
             
-            logging.info(f"File {filename} successfully deleted")
+            logging.info("File %s successfully deleted", filename)
             return dict(status='OK', data=f"File {filename} berhasil dihapus")
         except Exception as e:
             logging.error(f"Error in DELETE operation: {str(e)}")
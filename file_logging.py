@@ -0,0 +1,113 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# FILE_LOG_LEVEL sets the level directly; otherwise FILE_ENV=production means WARNING
+# (no per-request lines at all) and anything else INFO
+LOG_LEVEL = os.environ.get('FILE_LOG_LEVEL') or (
+    'WARNING' if os.environ.get('FILE_ENV', '').lower() == 'production' else 'INFO')
+# Fraction of records below WARNING that are kept, and at most this many of them per second
+# (0 = no limit). Warnings and errors are never dropped.
+LOG_SAMPLE = float(os.environ.get('FILE_LOG_SAMPLE', 1.0))
+LOG_RATE = int(os.environ.get('FILE_LOG_RATE', 0))
+# FILE_LOG_QUEUE=0 writes from the calling thread as logging.basicConfig does (for comparison)
+LOG_QUEUE = os.environ.get('FILE_LOG_QUEUE', '1') != '0'
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops a share of the per-request (below WARNING) records before they are
+    queued, so they are never formatted or written. The per-second limit is
+    counted without a lock; under contention it may let a few extra through.
+    """
+
+    def __init__(self, sample=LOG_SAMPLE, rate=LOG_RATE):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self.second = 0
+        self.count = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        if self.rate:
+            second = int(time.monotonic())
+            if second != self.second:
+                self.second = second
+                self.count = 0
+            self.count += 1
+            return self.count <= self.rate
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats each record in the calling thread so it could be
+    # pickled; within one process the record can go as it is and the listener formats it
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_settings = None
+_lock = threading.Lock()
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """
+    Configure the root logger for a server process. Request threads only put
+    records on a queue; a single listener thread formats them and writes to
+    `stream` (stderr by default), so no request waits on the handler's lock or
+    on the write. Forked worker processes start their own listener.
+    """
+    global _listener, _settings
+    with _lock:
+        stop_logging()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.setLevel(level)
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+        if LOG_QUEUE:
+            records = queue.SimpleQueue()
+            handler = DeferredQueueHandler(records)
+            _listener = logging.handlers.QueueListener(records, output)
+            _listener.start()
+        else:
+            handler = output
+        handler.addFilter(SamplingFilter())
+        root.addHandler(handler)
+        _settings = (level, stream)
+
+
+def stop_logging():
+    # Writes out whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    # The listener thread does not exist in a forked child; its records would only pile up
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        setup_logging(*_settings)
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,205 @@
+import atexit
+import cProfile
+import math
+import multiprocessing
+import os
+import pstats
+import random
+import signal
+import sys
+import threading
+import time
+
+# Defaults of a session started with SIGUSR2 (or PROFILE START without arguments):
+# profile this fraction of requests, for this many seconds (0 = until stopped)
+PROFILE_SAMPLE = float(os.environ.get('FILE_PROFILE_SAMPLE', 0.1))
+PROFILE_SECONDS = float(os.environ.get('FILE_PROFILE_SECONDS', 30))
+# Resolved at import, before the server changes into uploads/
+PROFILE_DIR = os.path.abspath(os.environ.get('FILE_PROFILE_DIR', 'profiles'))
+
+# Shared state: session number, fraction of requests profiled, end of the session
+# (epoch seconds, 0 = stopped)
+SESSION, FRACTION, UNTIL = range(3)
+
+
+class RequestProfiler:
+    """
+    Runs cProfile over a sample of requests while a profiling session is active.
+
+    The session (started and stopped with PROFILE or SIGUSR2) lives in shared
+    memory allocated before a pre-fork server forks, so it applies to every worker
+    at once. Each thread collects into its own cProfile.Profile; when a process
+    notices that the session has ended (at its next request, on PROFILE STOP, or
+    on exit) it writes what its threads collected to
+    PROFILE_DIR/profile-<pid>-s<session>-<n>.prof. A request that is still running
+    then is written to a further file once it finishes.
+
+    Outside a session a request costs a read of shared memory (and of the clock
+    once a timed session has run out). A Python whose
+    cProfile allows only one active profiler (3.12+) profiles one request at a
+    time; the others are skipped.
+    """
+
+    def __init__(self):
+        self.shared = multiprocessing.RawArray('d', 3)
+        self.state = memoryview(self.shared).cast('B').cast('d')
+        self._reset()
+
+    def _reset(self):
+        # Per process: a forked worker starts with nothing collected
+        self.session = 0
+        self.profiles = {}
+        self.busy = set()
+        self.files = 0
+        self.lock = threading.Lock()
+
+    def start(self, fraction=PROFILE_SAMPLE, seconds=PROFILE_SECONDS):
+        # Only plain stores, so it is safe in a signal handler
+        self.state[FRACTION] = min(1.0, max(0.0, fraction))
+        self.state[SESSION] += 1
+        self.state[UNTIL] = time.time() + seconds if seconds > 0 else math.inf
+
+    def stop(self):
+        self.state[UNTIL] = 0.0
+
+    def active(self):
+        return time.time() < self.state[UNTIL]
+
+    def status(self):
+        until = self.state[UNTIL]
+        return dict(active=self.active(), session=int(self.state[SESSION]), fraction=self.state[FRACTION],
+                    remaining=None if until in (0.0, math.inf) else round(max(0.0, until - time.time()), 1),
+                    directory=PROFILE_DIR)
+
+    def begin(self):
+        # Returns the profile enabled for this request, or None
+        until = self.state[UNTIL]
+        if not self.profiles and (until == 0.0 or time.time() >= until):
+            return None
+        now = time.time()
+        session = self.state[SESSION]
+        if self.profiles and (session != self.session or now >= until):
+            self.flush()
+        if now >= until or random.random() >= self.state[FRACTION]:
+            return None
+
+        with self.lock:
+            if session != self.session:
+                self.session = session
+                self.files = 0
+            thread = threading.get_ident()
+            profile = self.profiles.get(thread)
+            if profile is None:
+                profile = self.profiles[thread] = cProfile.Profile()
+            if profile in self.busy:
+                return None
+            self.busy.add(profile)
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this process
+            with self.lock:
+                self.busy.discard(profile)
+            return None
+        return profile
+
+    def end(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self.lock:
+            self.busy.discard(profile)
+        if self.state[SESSION] != self.session or not self.active():
+            self.flush()
+
+    def flush(self):
+        # Writes the profiles of threads not inside a profiled request; returns the file name or None
+        with self.lock:
+            done = [(thread, profile) for thread, profile in self.profiles.items() if profile not in self.busy]
+            if not done:
+                return None
+            for thread, _ in done:
+                del self.profiles[thread]
+            self.files += 1
+            path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-s{int(self.session)}-{self.files}.prof")
+        stats = pstats.Stats(done[0][1])
+        for _, profile in done[1:]:
+            stats.add(profile)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats.dump_stats(path)
+        return path
+
+
+_profiler = None
+
+
+def setup_profiling():
+    """
+    Allocate the shared session state. A pre-fork server calls this before forking,
+    so PROFILE or SIGUSR2 in any process controls all workers; a single-process
+    server may skip it.
+    """
+    global _profiler
+    _profiler = RequestProfiler()
+    return _profiler
+
+
+def request_profiler():
+    return _profiler if _profiler is not None else setup_profiling()
+
+
+def begin_profile():
+    return request_profiler().begin()
+
+
+def end_profile(profile):
+    if profile is not None:
+        _profiler.end(profile)
+
+
+def toggle_profiling(signum=None, frame=None):
+    # SIGUSR2: starts a session with the FILE_PROFILE_* defaults, or stops the running one
+    profiler = request_profiler()
+    if profiler.active():
+        profiler.stop()
+    else:
+        profiler.start()
+
+
+def install_profile_signal(signum=signal.SIGUSR2):
+    signal.signal(signum, toggle_profiling)
+
+
+def flush_profiles():
+    # Writes whatever this process collected; worker processes call it before they exit
+    if _profiler is not None:
+        return _profiler.flush()
+
+
+def _reset_after_fork():
+    if _profiler is not None:
+        _profiler._reset()
+
+
+atexit.register(flush_profiles)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def merge(paths, out=None, limit=30):
+    # Adds up profile files (of any workers and sessions); prints the top functions
+    stats = pstats.Stats(*paths)
+    if out:
+        stats.dump_stats(out)
+    stats.sort_stats('cumulative').print_stats(limit)
+
+
+if __name__ == '__main__':
+    # python file_profile.py [-o merged.prof] profiles/*.prof
+    args = sys.argv[1:]
+    out = None
+    if args[:1] == ['-o']:
+        out, args = args[1], args[2:]
+    if not args:
+        print("usage: python file_profile.py [-o merged.prof] profile.prof ...")
+        sys.exit(1)
+    merge(args, out)
@@ -1,30 +1,44 @@
 import json
 import logging
+import math
 import shlex
 
+from file_compress import COMPRESSIONS, IDENTITY, Compressor, choose_encoding
 from file_interface import FileInterface
+from file_session import ChunkWriter
+from file_profile import PROFILE_SAMPLE, PROFILE_SECONDS, request_profiler
+from file_stats import server_stats, watch_gauges
+from file_trace import phase, recent_traces
 
 class FileProtocol:
     def __init__(self):
         self.file = FileInterface()
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-        
+        # Every worker process publishes its cache counters for STATS
+        watch_gauges(self.cache_gauges)
+
+    def cache_gauges(self):
+        # Read without the caches' locks: a request never waits for STATS, which may be a moment behind
+        cache, flight, validators = self.file.response_cache, self.file.get_flight, self.file.validators
+        return (len(cache.entries), cache.size, cache.hits, cache.misses, cache.evictions,
+                flight.leaders, flight.shared, validators.hits, validators.misses)
+
     def proses_string(self, string_datamasuk=''):
-        logging.info(f"Received command: {string_datamasuk[:100]}..." if len(string_datamasuk) > 100 else string_datamasuk)
+        logging.info("Received command: %s%s", string_datamasuk[:100], "..." if len(string_datamasuk) > 100 else "")
         
         try:
             # Split only the first part to get the command and first parameter
             parts = string_datamasuk.split(' ', 2)
             c_request = parts[0].strip().lower()
             
-            logging.info(f"Processing request: {c_request}")
+            logging.info("Processing request: %s", c_request)
             
             # Handle each command type differently due to potential large data
-            if c_request == "list":
+            if c_request == "list" or c_request == "image":
                 params = []
             elif c_request == "get" or c_request == "delete":
                 params = [parts[1]] if len(parts) > 1 else []
-            elif c_request == "add":
+            elif c_request == "add" or c_request == "upload":
+                c_request = "add"
                 # For ADD command, we need to handle filename and content separately
                 if len(parts) < 3:
                     return json.dumps(dict(status='ERROR', data='ADD command requires filename and content'))
@@ -32,15 +46,33 @@ class FileProtocol:
                 filename = parts[1]
                 content = parts[2]  # This contains the base64 encoded file content
                 params = [filename, content]
+            elif c_request == "zadd":
+                # ZADD namafile kompresi <base64 data terkompresi>
+                parts = string_datamasuk.split(' ', 3)
+                if len(parts) < 4:
+                    return json.dumps(dict(status='ERROR', data='ZADD command requires filename, compression and content'))
+                params = parts[1:]
+            elif c_request in ("ustart", "ustatus", "ucommit", "uabort", "mdelete", "stat", "has", "link", "sigs"):
+                params = string_datamasuk.split()[1:]
+            elif c_request == "stats":
+                # Server metrics, not a file operation
+                return json.dumps(dict(status='OK', data=server_stats().snapshot()))
+            elif c_request == "trace":
+                # Recent request traces of the worker process answering
+                return json.dumps(dict(status='OK', data=recent_traces()))
+            elif c_request == "profile":
+                return json.dumps(self.profile(string_datamasuk.split()[1:]))
             else:
                 return json.dumps(dict(status='ERROR', data='request tidak dikenali'))
             
             # Process the command
-            cl = getattr(self.file, c_request)(params)
+            with phase(c_request):
+                cl = getattr(self.file, c_request)(params)
             
             # Create response
-            result = json.dumps(cl)
-            logging.info(f"Response length: {len(result)} bytes")
+            with phase('json'):
+                result = json.dumps(cl)
+            logging.info("Response length: %s bytes", len(result))
             
             return result
             
@@ -48,6 +80,210 @@ class FileProtocol:
             logging.error(f"Error processing request: {str(e)}")
             return json.dumps(dict(status='ERROR', data=f'Error: {str(e)}'))
 
+    def profile(self, params):
+        # PROFILE [START [fraction] [seconds] | STOP | STATUS], for every worker process of the server
+        usage = dict(status='ERROR', data='PROFILE expects START [fraction] [seconds], STOP or STATUS')
+        profiler = request_profiler()
+        action = params[0].lower() if params else 'status'
+        if action == 'start':
+            try:
+                fraction = float(params[1]) if len(params) > 1 else PROFILE_SAMPLE
+                seconds = float(params[2]) if len(params) > 2 else PROFILE_SECONDS
+            except ValueError:
+                return usage
+            # fraction between 0 and 1, seconds finite and not negative (0 = until STOP); rejects nan too
+            if not (0.0 <= fraction <= 1.0 and 0.0 <= seconds < math.inf):
+                return usage
+            profiler.start(fraction, seconds)
+        elif action == 'stop':
+            profiler.stop()
+            profiler.flush()
+        elif action != 'status':
+            return usage
+        return dict(status='OK', data=profiler.status())
+
+    def proses_binary(self, string_datamasuk=''):
+        # Binary commands carry raw bytes instead of base64 inside JSON
+        try:
+            parts = string_datamasuk.split()
+            c_request = parts[0].strip().lower()
+
+            # The file is opened here and sent by the server with sendfile
+            if c_request == "bget":
+                return self.file.stream_range(parts[1:2] + [0])
+            elif c_request == "brange":
+                params = self._range_params(parts)
+                if isinstance(params, dict):
+                    return params
+                return self.file.stream_range(params)
+            else:
+                return dict(status='ERROR', data='request tidak dikenali')
+
+        except Exception as e:
+            logging.error(f"Error processing binary request: {str(e)}")
+            return dict(status='ERROR', data=f'Error: {str(e)}')
+
+    def _range_params(self, parts):
+        # RANGE/BRANGE namafile offset [length]
+        if len(parts) < 3:
+            return dict(status='ERROR', data='RANGE command requires filename and offset')
+        try:
+            offset = int(parts[2])
+            length = int(parts[3]) if len(parts) > 3 else None
+        except ValueError:
+            return dict(status='ERROR', data='Offset and length must be integers')
+        if offset < 0 or (length is not None and length < 0):
+            return dict(status='ERROR', data='Offset and length must not be negative')
+        return [parts[1], offset, length]
+
+    def begin_upload(self, c_request, filename, args=(), compression=None):
+        # ADD/UPLOAD carry base64 text, BPUT carries raw bytes; both are written to disk as they arrive.
+        # ZADD is base64 of `compression`-compressed content, decompressed as it arrives.
+        # UCHUNK carries one raw chunk of an upload session, `filename` is then the session id.
+        # BDELTA carries delta instructions against the current file. `args` are the extra
+        # request fields of UCHUNK (chunk index) and BDELTA (base etag, target digest).
+        if c_request.lower() == 'uchunk':
+            return self.file.begin_chunk([filename, *args])
+        if c_request.lower() == 'bdelta':
+            return self.file.begin_delta([filename, *args])
+        encoding = 'raw' if c_request.lower() == 'bput' else 'base64'
+        return self.file.begin_upload([filename, encoding] + ([compression] if compression else []))
+
+    def finish_upload(self, writer):
+        if isinstance(writer, ChunkWriter):
+            return self.file.commit_chunk([writer])
+        return self.file.commit_upload([writer])
+
+    def proses_stream(self, string_datamasuk=''):
+        # Streaming variant for large responses: returns an iterable of response bytes
+        # (without the terminator), or None if the command is not streamed
+        parts = string_datamasuk.split(' ', 2)
+        c_request = parts[0].strip().lower()
+        if c_request == "range":
+            return self._stream_range(string_datamasuk.split())
+        if c_request == "mget":
+            return self._stream_mget(string_datamasuk.split()[1:])
+        if c_request == "zget":
+            return self._stream_zget(string_datamasuk.split())
+        if c_request != "get":
+            return None
+        # GET namafile [etag]
+        return self._stream_get(string_datamasuk.split()[1:3])
+
+    def _stream_get(self, params, batch=False):
+        # params = [filename] or [filename, etag]; with an etag that still matches the file,
+        # the answer is a short NOT_MODIFIED instead of the content
+        with phase('open'):
+            result = self.file.stream_get(params)
+        if result['status'] != 'OK':
+            if batch and params:
+                result['data_namafile'] = params[0]
+            return [json.dumps(result).encode()]
+
+        try:
+            with phase('etag'):
+                etag = self.file.etag(result)
+        except Exception as e:
+            result['data_file'].close()
+            logging.error(f"Error computing ETag of {result['data_namafile']}: {str(e)}")
+            return [json.dumps(dict(status='ERROR', data=str(e))).encode()]
+        if len(params) > 1 and params[1].lower() == etag:
+            result['data_file'].close()
+            return [json.dumps(dict(status='NOT_MODIFIED', data_namafile=result['data_namafile'], etag=etag)).encode()]
+        meta = dict(status='OK', data_namafile=result['data_namafile'], etag=etag)
+
+        # Hot files are answered from the response cache: no disk read, no base64
+        cache = self.file.response_cache
+        cached = cache.get(result['data_key'])
+        if cached is not None:
+            result['data_file'].close()
+            return [cached]
+
+        fileobj = result['data_file']
+        if cache.fits(4 * (result['data_size'] // 3 + 1) + len(result['data_namafile']) + 160):
+            def build():
+                chunks = self._iter_json_with_file(meta, self.file.iter_base64(fileobj))
+                response = b''.join(chunks)
+                cache.put(result['data_key'], response)
+                return response
+
+            # The first request for this file version encodes it; concurrent ones wait and share it
+            try:
+                with phase('encode'):
+                    return [self.file.get_flight.do(result['data_key'], build)]
+            finally:
+                fileobj.close()
+        return self._iter_json_with_file(meta, self.file.iter_base64(fileobj))
+
+    def _stream_mget(self, names):
+        # MGET namafile1 namafile2 ...: one response whose "data" holds a GET response per
+        # file, in request order. Files are opened one at a time while the response is sent.
+        if not names:
+            return [json.dumps(dict(status='ERROR', data='MGET command requires at least one filename')).encode()]
+        logging.info("Batch GET of %s files", len(names))
+
+        def pieces():
+            yield b'{"status": "OK", "data": ['
+            for i, name in enumerate(names):
+                if i:
+                    yield b', '
+                yield from self._stream_get([name], batch=True)
+            yield b']}'
+        return pieces()
+
+    def _stream_zget(self, parts):
+        # ZGET namafile [zlib|lzma]: the file compressed with the requested algorithm (zlib by
+        # default), unless its type or a sample shows it would not shrink ("encoding": "identity").
+        # Compressed size and compression CPU time follow the data.
+        if len(parts) < 2:
+            return [json.dumps(dict(status='ERROR', data='ZGET command requires filename')).encode()]
+        requested = parts[2].lower() if len(parts) > 2 else 'zlib'
+        if requested not in COMPRESSIONS + (IDENTITY,):
+            return [json.dumps(dict(status='ERROR', data=f'Kompresi {requested} tidak dikenal')).encode()]
+
+        result = self.file.stream_get(parts[1:2])
+        if result['status'] != 'OK':
+            return [json.dumps(result).encode()]
+
+        fileobj = result['data_file']
+        try:
+            encoding = choose_encoding(result['data_namafile'], fileobj, requested)
+        except Exception as e:
+            fileobj.close()
+            logging.error(f"Error in ZGET operation: {str(e)}")
+            return [json.dumps(dict(status='ERROR', data=str(e))).encode()]
+
+        meta = dict(status='OK', data_namafile=result['data_namafile'], encoding=encoding, size=result['data_size'])
+        if encoding == IDENTITY:
+            return self._iter_json_with_file(meta, self.file.iter_base64(fileobj),
+                                             lambda: dict(compressed_size=result['data_size'], cpu_time=0.0))
+
+        compressor = Compressor(encoding)
+        return self._iter_json_with_file(meta, self.file.iter_compressed_base64(fileobj, compressor),
+                                         lambda: dict(compressed_size=compressor.size,
+                                                      cpu_time=round(compressor.cpu_time, 4)))
+
+    def _stream_range(self, parts):
+        params = self._range_params(parts)
+        result = params if isinstance(params, dict) else self.file.stream_range(params)
+        if result['status'] != 'OK':
+            return [json.dumps(result).encode()]
+
+        # size and mtime_ns let clients check that all ranges come from the same file version
+        meta = dict(status='OK', data_namafile=result['data_namafile'], offset=result['data_offset'],
+                    length=result['data_length'], size=result['data_size'], mtime_ns=result['data_mtime'])
+        return self._iter_json_with_file(meta, self.file.iter_base64(result['data_file'], count=result['data_length']))
+
+    def _iter_json_with_file(self, meta, encoded_chunks, trailer=None):
+        # Produces exactly what json.dumps() of meta plus a data_file field would, without
+        # holding the encoded file in memory. trailer() may add fields known only after the data.
+        yield (json.dumps(meta)[:-1] + ', "data_file": "').encode()
+        yield from encoded_chunks
+        if trailer is None:
+            yield b'"}'
+        else:
+            yield ('", ' + json.dumps(trailer())[1:]).encode()
+
 
 if __name__=='__main__':
     #contoh pemakaian
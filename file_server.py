@@ -3,8 +3,12 @@ import socket
 import threading
 import logging
 import sys
+from file_logging import setup_logging
 from file_protocol import FileProtocol
+from file_stats import OPENED, server_stats
+from file_transfer import serve_client
 
+setup_logging()
 # Inisialisasi FileProtocol
 fp = FileProtocol()
 
@@ -15,16 +19,7 @@ class ProcessTheClient(threading.Thread):
         threading.Thread.__init__(self)
 
     def run(self):
-        while True:
-            data = self.connection.recv(4096)  # Meningkatkan ukuran buffer untuk menerima lebih banyak data
-            if data:
-                d = data.decode()
-                hasil = fp.proses_string(d)
-                hasil = hasil + "\r\n\r\n"
-                self.connection.sendall(hasil.encode())
-            else:
-                break
-        self.connection.close()
+        serve_client(self.connection, self.address, fp)
 
 class Server(threading.Thread):
     def __init__(self, ipaddress='0.0.0.0', port=45000):  # Mengubah port sesuai instruksi
@@ -41,6 +36,7 @@ class Server(threading.Thread):
         while True:
             self.connection, self.client_address = self.my_socket.accept()
             logging.warning(f"Connection from {self.client_address}")
+            server_stats().count(OPENED)
 
             clt = ProcessTheClient(self.connection, self.client_address)
             clt.start()
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from file_logging import setup_logging
+from file_protocol import FileProtocol
+from file_stats import CLOSED, OPENED, is_error, server_stats, setup_stats
+from file_transfer import (TERMINATOR, BINARY_COMMANDS, BINARY_UPLOADS, BINARY_UPLOAD_USAGE, MAX_HEADER,
+                           UPLOAD_CHUNK_SIZE, IDLE_TIMEOUT, PIPELINE_DEPTH, STATUS_OK, STATUS_ERROR,
+                           binary_upload_params, pack_header, range_prefix, split_tag, tagged_response,
+                           upload_header)
+
+setup_logging()
+fp = FileProtocol()
+
+
+class AsyncRequestReader:
+    # Same framing as file_transfer.RequestReader, on top of an asyncio StreamReader
+
+    def __init__(self, reader, chunk_size=2**16):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.checked = 0
+
+    async def read_request(self, detect=None):
+        while True:
+            end = self.buffer.find(TERMINATOR, max(0, self.scanned - len(TERMINATOR) + 1))
+            if end >= 0:
+                request = bytes(self.buffer[:end])
+                del self.buffer[:end + len(TERMINATOR)]
+                self.scanned = self.checked = 0
+                return request, None
+            self.scanned = len(self.buffer)
+
+            if detect is not None and self.buffer and self.checked < MAX_HEADER:
+                header = detect(bytes(self.buffer[:MAX_HEADER]))
+                self.checked = len(self.buffer)
+                if header is not None:
+                    return None, header
+
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                return None, None
+            self.buffer += chunk
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.scanned = self.checked = 0
+        return data
+
+    def unread(self, data):
+        self.buffer[:0] = data
+        self.scanned = self.checked = 0
+
+
+class Server:
+    def __init__(self, ipaddress='0.0.0.0', port=13337, max_workers=10, chunk_size=2**20,
+                 upload_chunk_size=UPLOAD_CHUNK_SIZE, idle_timeout=IDLE_TIMEOUT):
+        self.ipinfo = (ipaddress, port)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.upload_chunk_size = upload_chunk_size
+        # Seconds a connection may stay silent between requests before it is closed
+        self.idle_timeout = idle_timeout
+        # Blocking FileInterface work (disk, base64, json) runs here, never on the event loop
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def offload(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def receive_upload(self, reader, c_request, filename, pending, size=None, args=(),
+                             compression=None):
+        """
+        Stream an upload to disk while it arrives. `size` is the payload length for
+        BPUT/UCHUNK, None for terminator-delimited base64. Returns (result, leftover,
+        bytes of the upload received), like file_transfer.handle_upload.
+        """
+        result = await self.offload(fp.begin_upload, c_request, filename, args, compression)
+        if result['status'] != 'OK':
+            return result, None, 0
+
+        upload = result['data_file']
+        received = len(pending)
+        try:
+            if size is None:
+                data = pending
+                keep = len(TERMINATOR) - 1
+                while True:
+                    end = data.find(TERMINATOR)
+                    if end >= 0:
+                        await self.offload(upload.write, data[:end])
+                        pending = data[end + len(TERMINATOR):]
+                        break
+                    if len(data) > keep:
+                        await self.offload(upload.write, data[:-keep])
+                        data = data[-keep:]
+                    chunk = await reader.read(self.upload_chunk_size)
+                    if not chunk:
+                        raise ConnectionError("Connection closed before upload was complete")
+                    received += len(chunk)
+                    data += chunk
+            else:
+                data, pending = pending[:size], pending[size:]
+                remaining = size - len(data)
+                await self.offload(upload.write, data)
+                while remaining > 0:
+                    chunk = await reader.read(min(self.upload_chunk_size, remaining))
+                    if not chunk:
+                        raise ConnectionError(f"Connection closed with {remaining} payload bytes outstanding")
+                    received += len(chunk)
+                    await self.offload(upload.write, chunk)
+                    remaining -= len(chunk)
+        except Exception:
+            await self.offload(upload.abort)
+            raise
+
+        return await self.offload(fp.finish_upload, upload), pending, received - len(pending)
+
+    async def send_frame(self, writer, status, name, payload=b''):
+        # Returns the number of bytes sent
+        header = pack_header(status, name, len(payload))
+        writer.write(header)
+        if payload:
+            writer.write(payload)
+        await writer.drain()
+        return len(header) + len(payload)
+
+    async def handle_binary(self, reader, writer, request, requests):
+        start_time = time.perf_counter()
+        parts = request.split()
+        c_request = parts[0].lower()
+        name = parts[1] if len(parts) > 1 else ''
+        received = len(request) + len(TERMINATOR)
+
+        if c_request in BINARY_UPLOADS:
+            params = binary_upload_params(parts)
+            if params is None:
+                sent = await self.send_frame(writer, STATUS_ERROR, name, BINARY_UPLOAD_USAGE)
+                server_stats().record(c_request, time.perf_counter() - start_time, received, sent, ok=False)
+                return False
+            args, size = params
+            result, pending, payload = await self.receive_upload(reader, c_request, name, requests.take(),
+                                                                 size, args)
+            received += payload
+            if pending is None:
+                sent = await self.send_frame(writer, STATUS_ERROR, name, str(result['data']).encode())
+                server_stats().record(c_request, time.perf_counter() - start_time, received, sent, ok=False)
+                return False
+            requests.unread(pending)
+        else:
+            result = await self.offload(fp.proses_binary, request)
+
+        if result['status'] == 'OK' and 'data_offset' in result:
+            with result['data_file'] as fileobj:
+                prefix = range_prefix(c_request, result)
+                header = pack_header(STATUS_OK, result['data_namafile'], len(prefix) + result['data_length']) + prefix
+                writer.write(header)
+                await writer.drain()
+                if result['data_length']:
+                    await asyncio.get_running_loop().sendfile(writer.transport, fileobj,
+                                                              result['data_offset'], result['data_length'])
+            sent = len(header) + result['data_length']
+        elif result['status'] == 'OK':
+            body = result['data_file'] if 'data_file' in result else str(result['data']).encode()
+            sent = await self.send_frame(writer, STATUS_OK, result.get('data_namafile', name), body)
+        else:
+            sent = await self.send_frame(writer, STATUS_ERROR, name, str(result['data']).encode())
+        server_stats().record(c_request, time.perf_counter() - start_time, received, sent,
+                              ok=result['status'] == 'OK')
+        return True
+
+    async def write_stream(self, writer, chunks, status_pieces=1):
+        # Returns (bytes sent, ok); the status is in the first piece, or the first two of a
+        # pipelined response, whose "id" comes as a piece of its own
+        chunks = iter(chunks)
+        total_bytes = 0
+        ok = True
+        index = 0
+        while True:
+            piece = await self.offload(next, chunks, None)
+            if piece is None:
+                break
+            if index < status_pieces and is_error(piece):
+                ok = False
+            index += 1
+            total_bytes += len(piece)
+            # A cached response arrives as one large piece; hand it to the transport in
+            # slices so only the unsent part of one slice is ever copied per client
+            with memoryview(piece) as view:
+                for offset in range(0, len(view), self.chunk_size):
+                    writer.write(view[offset:offset + self.chunk_size])
+                    await writer.drain()
+        writer.write(TERMINATOR)
+        await writer.drain()
+        return total_bytes + len(TERMINATOR), ok
+
+    async def handle_tagged(self, writer, request, send_lock, slots):
+        # One pipelined request; its response is written whole under the connection's send lock
+        start_time = time.perf_counter()
+        request_id, command = split_tag(request.decode())
+        try:
+            pieces = await self.offload(tagged_response, fp, request_id, command)
+            async with send_lock:
+                sent, ok = await self.write_stream(writer, pieces, status_pieces=2)
+            server_stats().record(command.split(' ', 1)[0].lower(), time.perf_counter() - start_time,
+                                  len(request) + len(TERMINATOR), sent, ok)
+        except Exception as e:
+            logging.error(f"Error answering pipelined request {request_id}: {e}")
+            writer.close()
+        finally:
+            slots.release()
+
+    async def handle_request(self, reader, writer, request, requests):
+        received = len(request) + len(TERMINATOR)
+        request = request.decode().strip()
+        c_request = request.split(' ', 1)[0].lower()
+
+        if c_request in BINARY_COMMANDS:
+            return await self.handle_binary(reader, writer, request, requests)
+
+        start_time = time.perf_counter()
+        chunks = await self.offload(fp.proses_stream, request)
+        if chunks is not None:
+            sent, ok = await self.write_stream(writer, chunks)
+            server_stats().record(c_request, time.perf_counter() - start_time, received, sent, ok)
+            return True
+
+        processed = await self.offload(fp.proses_string, request)
+        response_bytes = (processed + "\r\n\r\n").encode()
+        writer.write(response_bytes)
+        await writer.drain()
+        server_stats().record(c_request, time.perf_counter() - start_time, received, len(response_bytes),
+                              not is_error(response_bytes))
+        return True
+
+    async def handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        requests = AsyncRequestReader(reader, self.chunk_size)
+        # Pipelined ("#id") requests of this connection run as concurrent tasks
+        pipelined = set()
+        send_lock = asyncio.Lock()
+        slots = asyncio.Semaphore(PIPELINE_DEPTH)
+        server_stats().count(OPENED)
+        try:
+            logging.info("Processing client %s", address)
+            while True:
+                try:
+                    request, header = await asyncio.wait_for(requests.read_request(detect=upload_header),
+                                                             self.idle_timeout)
+                except asyncio.TimeoutError:
+                    logging.info("Connection with %s idle for %.0f seconds, closing",
+                                 address, self.idle_timeout)
+                    break
+                start_time = time.time()
+                if request is not None and request.startswith(b'#'):
+                    await slots.acquire()
+                    task = asyncio.create_task(self.handle_tagged(writer, request, send_lock, slots))
+                    pipelined.add(task)
+                    task.add_done_callback(pipelined.discard)
+                    continue
+                if pipelined:
+                    # An untagged request is answered after all earlier pipelined ones
+                    await asyncio.gather(*pipelined)
+                if header is not None:
+                    c_request, filename, header_length, compression = header
+                    upload_start = time.perf_counter()
+                    pending = requests.take()[header_length:]
+                    result, pending, received = await self.receive_upload(reader, c_request, filename, pending,
+                                                                          compression=compression)
+                    response_bytes = (json.dumps(result) + "\r\n\r\n").encode()
+                    writer.write(response_bytes)
+                    await writer.drain()
+                    server_stats().record(c_request.lower(), time.perf_counter() - upload_start,
+                                          header_length + received, len(response_bytes),
+                                          result['status'] == 'OK')
+                    if pending is None:
+                        break
+                    requests.unread(pending)
+                elif request is not None:
+                    if not await self.handle_request(reader, writer, request, requests):
+                        break
+                else:
+                    break
+                logging.info("Request from %s processed in %.2f seconds", address, time.time() - start_time)
+        except Exception as e:
+            logging.error(f"Error handling client {address}: {e}")
+        finally:
+            if pipelined:
+                await asyncio.gather(*pipelined, return_exceptions=True)
+            logging.info("Closing connection with %s", address)
+            writer.close()
+            server_stats().count(CLOSED)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, *self.ipinfo, reuse_address=True,
+                                            backlog=1024, limit=self.chunk_size)
+        logging.warning(f"Server running on {self.ipinfo}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        # Requests are recorded on the event loop thread only, so one STATS slot is enough
+        setup_stats(threads=1)
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logging.warning("Server shutting down.")
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def main():
+    if len(sys.argv) > 1:
+        try:
+            max_workers = int(sys.argv[1])
+            if max_workers <= 0:
+                raise ValueError("Number of workers must be positive.")
+        except ValueError as e:
+            print(f"Invalid argument: {e}. Using default value of 10.")
+            max_workers = 10
+    else:
+        max_workers = 10
+
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 13337
+
+    svr = Server(ipaddress='0.0.0.0', port=port, max_workers=max_workers)
+    svr.run()
+
+
+if __name__ == "__main__":
+    main()
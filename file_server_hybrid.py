@@ -0,0 +1,82 @@
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Importing the process-pool server also creates its FileProtocol (and enters uploads/),
+# so this module must not create another one
+import file_server_processpool
+from file_logging import stop_logging
+from file_profile import flush_profiles
+from file_server_processpool import ProcessTheClient, create_listener
+from file_transfer import KeepAlive
+
+def hybrid_worker_loop(listen_socket, ipinfo, reuse_port, threads):
+    # One worker process: T threads serve requests on connections accepted by this process.
+    # While every thread is busy the selector stops (no accepts), so idle processes pick up the rest.
+    if reuse_port:
+        listen_socket = create_listener(ipinfo, reuse_port=True)
+    logging.warning(f"Worker {os.getpid()} accepting connections with {threads} threads")
+    free_threads = threading.BoundedSemaphore(threads)
+
+    def serve(connection, address, reader):
+        try:
+            ProcessTheClient((connection, address), keep_alive, reader)
+        finally:
+            free_threads.release()
+
+    def submit(connection, address, reader):
+        free_threads.acquire()
+        executor.submit(serve, connection, address, reader)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        keep_alive = KeepAlive(submit, listener=listen_socket, timeout=300)
+        try:
+            keep_alive.run()
+        except (KeyboardInterrupt, SystemExit):
+            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            keep_alive.close()
+            listen_socket.close()
+            flush_profiles()
+            stop_logging()
+
+class Server(file_server_processpool.Server):
+    def __init__(self, ipaddress='0.0.0.0', port=13337, processes=2, threads=10, reuse_port=False):
+        super().__init__(ipaddress=ipaddress, port=port, max_workers=processes, reuse_port=reuse_port)
+        self.threads = threads
+
+    def worker_main(self):
+        hybrid_worker_loop(self.my_socket, self.ipinfo, self.reuse_port, self.threads)
+
+
+def parse_shape(shape):
+    # "P x T", e.g. "4x8": P worker processes each with T threads
+    match = re.fullmatch(r'\s*(\d+)\s*[xX*]\s*(\d+)\s*', shape)
+    if not match:
+        raise ValueError(f"Expected PxT (e.g. 4x8), got '{shape}'")
+    processes, threads = int(match.group(1)), int(match.group(2))
+    if processes <= 0 or threads <= 0:
+        raise ValueError("Number of processes and threads must be positive.")
+    return processes, threads
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    try:
+        processes, threads = parse_shape(args[0]) if len(args) > 0 else (2, 10)
+    except ValueError as e:
+        print(f"Invalid argument: {e}. Using default value of 2x10.")
+        processes, threads = 2, 10
+
+    port = int(args[1]) if len(args) > 1 else 13337
+
+    svr = Server(ipaddress='0.0.0.0', port=port, processes=processes, threads=threads,
+                 reuse_port='--reuseport' in sys.argv)
+    svr.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,160 @@
 from socket import *
 import socket
-import threading
 import logging
+import os
+import signal
 import time
 import sys
 import multiprocessing
-from multiprocessing import Process, Queue, Pool
-import io
+from multiprocessing.connection import wait
 
+from file_logging import setup_logging, stop_logging
+from file_profile import flush_profiles, install_profile_signal, setup_profiling
 from file_protocol import FileProtocol
+from file_stats import server_stats, setup_stats
+from file_trace import install_trace_signal
+from file_transfer import PIPELINE_WORKERS, KeepAlive, serve_client
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 fp = FileProtocol()
 
-def ProcessTheClient(client_data):
+# A worker that dies sooner than this after starting is restarted with a delay,
+# so a persistent failure (e.g. bind error) does not turn into a fork loop
+MIN_WORKER_UPTIME = 1.0
+
+def ProcessTheClient(client_data, keep_alive=None, reader=None):
     connection, address = client_data
-    buffer = b''
+    serve_client(connection, address, fp, keep_alive=keep_alive, reader=reader)
+
+def create_listener(ipinfo, reuse_port=False):
+    my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker binds its own socket and the kernel balances accepts between them
+        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**20)
+    my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2**20)
+    my_socket.bind(ipinfo)
+    my_socket.listen(128)
+    return my_socket
+
+def worker_loop(listen_socket, ipinfo, reuse_port):
+    # Long-lived worker: serves requests one after another. Idle keep-alive connections
+    # wait in the selector, so one silent client cannot hold the whole worker.
+    if reuse_port:
+        listen_socket = create_listener(ipinfo, reuse_port=True)
+    logging.warning(f"Worker {os.getpid()} accepting connections")
+    keep_alive = KeepAlive(lambda connection, address, reader:
+                           ProcessTheClient((connection, address), keep_alive, reader),
+                           listener=listen_socket, timeout=300)
     try:
-        logging.info(f"Processing client {address}")
-        while True:
-            chunk = connection.recv(2**20) 
-            if not chunk:
-                break
-                
-            buffer += chunk
-            
-            if b"\r\n\r\n" in buffer:
-                # Get the complete message
-                request = buffer.decode()
-                logging.info(f"Complete request received from {address} ({len(buffer)} bytes)")
-                
-                # Process the request
-                start_time = time.time()
-                processed = fp.proses_string(request.strip())
-                end_time = time.time()
-                
-                logging.info(f"Request processed in {end_time - start_time:.2f} seconds")
-                
-                response = processed + "\r\n\r\n"
-                
-                response_bytes = response.encode()
-                total_bytes = len(response_bytes)
-                logging.info(f"Sending response ({total_bytes} bytes)")
-                
-                chunk_size = 2**16
-                for i in range(0, total_bytes, chunk_size):
-                    connection.sendall(response_bytes[i:i+chunk_size])
-                
-                logging.info(f"Response sent to {address}")
-                buffer = b''  
-                
-    except Exception as e:
-        logging.error(f"Error handling client {address}: {e}")
+        keep_alive.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
     finally:
-        logging.info(f"Closing connection with {address}")
-        connection.close()
+        keep_alive.close()
+        listen_socket.close()
+        # Worker processes end with os._exit, without atexit handlers
+        flush_profiles()
+        stop_logging()
 
 class Server:
-    def __init__(self, ipaddress='0.0.0.0', port=6666, max_workers=10):
+    def __init__(self, ipaddress='0.0.0.0', port=6666, max_workers=10, reuse_port=False):
         self.ipinfo = (ipaddress, port)
         self.max_workers = max_workers
-        
-    def handle_connection(self, connection, address):
-        ProcessTheClient((connection, address))
-        
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.my_socket = None
+        # Threads serving requests in each worker (besides those answering pipelined requests)
+        self.threads = 1
+        self.workers = {}
+        # Workers inherit the listening socket and the uploads working directory by forking
+        self.context = multiprocessing.get_context('fork')
+
+    def worker_main(self):
+        worker_loop(self.my_socket, self.ipinfo, self.reuse_port)
+
+    def run_worker(self, slot):
+        # A restarted worker takes over the counters of the one it replaces
+        server_stats().bind(slot)
+        install_trace_signal()
+        self.worker_main()
+
+    def forward_signal(self, signum, frame):
+        # SIGUSR1 to the supervisor is meant for the workers, which hold the traces
+        for p, _ in self.workers.values():
+            if p.pid is not None:
+                os.kill(p.pid, signum)
+
+    def start_worker(self, slot):
+        p = self.context.Process(target=self.run_worker, args=(slot,))
+        p.daemon = True
+        p.start()
+        self.workers[slot] = (p, time.time())
+        return p
+
+    def supervise(self):
+        while True:
+            sentinels = {p.sentinel: slot for slot, (p, _) in self.workers.items()}
+            for sentinel in wait(list(sentinels)):
+                slot = sentinels[sentinel]
+                p, started = self.workers[slot]
+                p.join()
+                logging.warning(f"Worker {p.pid} exited with code {p.exitcode}, restarting")
+                if time.time() - started < MIN_WORKER_UPTIME:
+                    time.sleep(MIN_WORKER_UPTIME)
+                self.start_worker(slot)
+
     def run(self):
-        my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**20)  
-        my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2**20)
-        
-        logging.warning(f"Server running on {self.ipinfo}")
-        my_socket.bind(self.ipinfo)
-        my_socket.listen(10)
-        
-        pool = multiprocessing.Pool(processes=self.max_workers)
-        
+        # Pre-fork: N long-lived workers share the listening socket (or each bind
+        # their own with SO_REUSEPORT) instead of forking once per connection
+        if not self.reuse_port:
+            self.my_socket = create_listener(self.ipinfo)
+
+        logging.warning(f"Server running on {self.ipinfo} with {self.max_workers} worker processes"
+                        f"{' (SO_REUSEPORT)' if self.reuse_port else ''}")
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGUSR1, self.forward_signal)
+
+        # STATS counters and the PROFILE session in shared memory, inherited by the fork
+        setup_stats(self.max_workers, self.threads + PIPELINE_WORKERS + 1)
+        setup_profiling()
+        # SIGUSR2 starts or stops profiling in all workers
+        install_profile_signal()
+        for slot in range(self.max_workers):
+            self.start_worker(slot)
+
         try:
-            while True:
-                connection, address = my_socket.accept()
-                p = Process(target=self.handle_connection, args=(connection, address))
-                p.daemon = True
-                p.start()
-                connection.close()
-                
-        except KeyboardInterrupt:
+            self.supervise()
+        except (KeyboardInterrupt, SystemExit):
             logging.warning("Server shutting down.")
         finally:
-            pool.close()
-            pool.join()
-            my_socket.close()
+            for p, _ in self.workers.values():
+                p.terminate()
+            for p, _ in self.workers.values():
+                p.join()
+            if self.my_socket is not None:
+                self.my_socket.close()
 
 
 def main():
-    if len(sys.argv) > 1:
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if len(args) > 0:
         try:
-            max_workers = int(sys.argv[1])
+            max_workers = int(args[0])
             if max_workers <= 0:
                 raise ValueError("Number of workers must be positive.")
         except ValueError as e:
             print(f"Invalid argument: {e}. Using default value of 10.")
             max_workers = 10
     else:
-        max_workers = 10  
-        
-    svr = Server(ipaddress='0.0.0.0', port=13337, max_workers=max_workers)
+        max_workers = 10
+
+    port = int(args[1]) if len(args) > 1 else 13337
+
+    svr = Server(ipaddress='0.0.0.0', port=port, max_workers=max_workers,
+                 reuse_port='--reuseport' in sys.argv)
     svr.run()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,53 +2,22 @@ from socket import *
 import socket
 import threading
 import logging
-import time
 import sys
 from concurrent.futures import ThreadPoolExecutor
 import io
 
+from file_logging import setup_logging
 from file_protocol import FileProtocol
+from file_profile import install_profile_signal
+from file_stats import setup_stats
+from file_trace import install_trace_signal
+from file_transfer import PIPELINE_WORKERS, KeepAlive, serve_client
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 fp = FileProtocol()
 
-def ProcessTheClient(connection, address):
-    buffer = b''
-    try:
-        logging.info(f"Processing client {address}")
-        while True:
-            chunk = connection.recv(2**20) 
-            if not chunk:
-                break
-                
-            buffer += chunk
-            
-            if b"\r\n\r\n" in buffer:
-                request = buffer.decode()
-                logging.info(f"Complete request received from {address} ({len(buffer)} bytes)")
-                
-                start_time = time.time()
-                processed = fp.proses_string(request.strip())
-                end_time = time.time()
-                logging.info(f"Request processed in {end_time - start_time:.2f} seconds")
-                response = processed + "\r\n\r\n"
-                
-                response_bytes = response.encode()
-                total_bytes = len(response_bytes)
-                logging.info(f"Sending response ({total_bytes} bytes)")
-                
-                chunk_size = 2**20
-                for i in range(0, total_bytes, chunk_size):
-                    connection.sendall(response_bytes[i:i+chunk_size])
-                
-                logging.info(f"Response sent to {address}")
-                buffer = b''  # Reset buffer for next request
-                
-    except Exception as e:
-        logging.error(f"Error handling client {address}: {e}")
-    finally:
-        logging.info(f"Closing connection with {address}")
-        connection.close()
+def ProcessTheClient(connection, address, keep_alive=None, reader=None):
+    serve_client(connection, address, fp, keep_alive=keep_alive, reader=reader)
 
 class Server:
     def __init__(self, ipaddress='0.0.0.0', port=13337, max_workers=10):
@@ -64,17 +33,24 @@ class Server:
         logging.warning(f"Server running on {self.ipinfo}")
         self.my_socket.bind(self.ipinfo)
         self.my_socket.listen(10)
+        # A STATS slot for every thread that may serve a request: workers, pipeline threads, selector
+        setup_stats(threads=self.max_workers + PIPELINE_WORKERS + 1)
+        # SIGUSR1 writes the recent request traces to traces/trace-<pid>.jsonl
+        install_trace_signal()
+        # SIGUSR2 starts or stops profiling a sample of requests
+        install_profile_signal()
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Connections wait in the keep-alive selector between requests (5-minute socket
+            # timeout while a request is served), so a thread is only busy while serving
+            keep_alive = KeepAlive(lambda connection, address, reader:
+                                   executor.submit(ProcessTheClient, connection, address, keep_alive, reader),
+                                   listener=self.my_socket, timeout=300)
             try:
-                while True:
-                    connection, address = self.my_socket.accept()
-                    logging.warning(f"Accepted connection from {address}")
-                    # Increase socket timeout
-                    connection.settimeout(300)  # 5-minute timeout
-                    executor.submit(ProcessTheClient, connection, address)
+                keep_alive.run()
             except KeyboardInterrupt:
                 logging.warning("Server shutting down.")
             finally:
+                keep_alive.close()
                 self.my_socket.close()
 
 
@@ -89,10 +65,10 @@ def main():
             max_workers = 10
     else:
         max_workers = 10  # Default value
-        
-    
-    
-    svr = Server(ipaddress='0.0.0.0', port=13337, max_workers=max_workers)  # Increased max workers
+
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 13337
+
+    svr = Server(ipaddress='0.0.0.0', port=port, max_workers=max_workers)
     svr.run()
 
 
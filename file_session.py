@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import time
+import uuid
+
+SESSION_ID = re.compile(r'[0-9a-f]{32}')
+SESSION_FILE = re.compile(r'\.session-([0-9a-f]{32})\.(json|map|data)')
+# Sessions with no chunk written for this many seconds are aborted (FILE_SESSION_TTL=0 keeps them forever)
+SESSION_TTL = float(os.environ.get('FILE_SESSION_TTL', 24 * 3600))
+
+
+class ChunkWriter:
+    # Writes one numbered chunk of an upload session at its offset in the session's
+    # data file. Same interface as UploadWriter, so it can be fed by handle_upload().
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+        self.filename = session.filename
+        self.offset, self.length = session.chunk_range(index)
+        self.fd = os.open(session.path('data'), os.O_WRONLY)
+        self.size = 0
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        if self.size + len(data) > self.length:
+            self.error = f"Chunk {self.index} is longer than {self.length} bytes"
+            return
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset + self.size)
+            view = view[written:]
+            self.size += written
+
+    def commit(self):
+        os.close(self.fd)
+        if self.error is None and self.size != self.length:
+            self.error = f"Chunk {self.index} has {self.size} bytes, expected {self.length}"
+        if self.error is not None:
+            return False
+        # The chunk only counts as present once all of its bytes are in the data file
+        self.session.mark(self.index)
+        return True
+
+    def abort(self):
+        os.close(self.fd)
+
+
+class UploadSession:
+    """
+    Resumable upload assembled from fixed-size chunks that may arrive in any order,
+    over any number of connections and server processes.
+
+    All state lives in hidden files next to the uploads, so every worker sees the same session:
+      .session-<id>.json  filename, total size and chunk size
+      .session-<id>.data  the file being assembled, allocated to its final size
+      .session-<id>.map   one byte per chunk, set once that chunk is complete
+    """
+
+    def __init__(self, session_id, filename, size, chunk_size):
+        self.session_id = session_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+
+    @property
+    def chunks(self):
+        return -(-self.size // self.chunk_size)
+
+    def path(self, kind):
+        return f".session-{self.session_id}.{kind}"
+
+    @classmethod
+    def create(cls, filename, size, chunk_size):
+        if size < 0 or chunk_size <= 0:
+            raise ValueError("Size must not be negative and chunk size must be positive")
+        session = cls(uuid.uuid4().hex, filename, size, chunk_size)
+        with open(session.path('data'), 'wb') as f:
+            f.truncate(size)
+        with open(session.path('map'), 'wb') as f:
+            f.truncate(session.chunks)
+        # Written last: a session only exists once its data and map files do
+        with open(session.path('json'), 'w') as f:
+            json.dump(dict(filename=filename, size=size, chunk_size=chunk_size), f)
+        return session
+
+    @classmethod
+    def open(cls, session_id):
+        if not SESSION_ID.fullmatch(session_id):
+            raise ValueError(f"Invalid session {session_id}")
+        try:
+            with open(f".session-{session_id}.json") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Session {session_id} not found") from None
+        return cls(session_id, meta['filename'], meta['size'], meta['chunk_size'])
+
+    @classmethod
+    def expire(cls, ttl=SESSION_TTL):
+        # Removes sessions idle for longer than ttl seconds, judged by the newest of their
+        # files (the data and map files change with every chunk); returns their ids
+        if ttl <= 0:
+            return []
+        newest = {}
+        with os.scandir('.') as it:
+            for entry in it:
+                match = SESSION_FILE.fullmatch(entry.name)
+                if match is None:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                session_id = match.group(1)
+                newest[session_id] = max(mtime, newest.get(session_id, mtime))
+        cutoff = time.time() - ttl
+        expired = [session_id for session_id, mtime in newest.items() if mtime < cutoff]
+        for session_id in expired:
+            # Constructed directly: a session left without its .json by a crash is removed as well
+            cls(session_id, None, 0, 1).remove()
+        return expired
+
+    def chunk_range(self, index):
+        if not 0 <= index < self.chunks:
+            raise ValueError(f"Chunk {index} out of range (0-{self.chunks - 1})")
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def chunk_writer(self, index):
+        return ChunkWriter(self, index)
+
+    def mark(self, index):
+        fd = os.open(self.path('map'), os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'\x01', index)
+        finally:
+            os.close(fd)
+
+    def present(self):
+        with open(self.path('map'), 'rb') as f:
+            chunk_map = f.read()
+        return [i for i, flag in enumerate(chunk_map) if flag]
+
+    def missing(self):
+        present = set(self.present())
+        return [i for i in range(self.chunks) if i not in present]
+
+    def commit(self, publish=os.replace):
+        # Publishes the assembled file atomically with publish(data path, filename);
+        # returns the missing chunks if incomplete
+        missing = self.missing()
+        if missing:
+            return missing
+        publish(self.path('data'), self.filename)
+        self.remove()
+        return []
+
+    def remove(self):
+        for kind in ('json', 'map', 'data'):
+            try:
+                os.remove(self.path(kind))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,230 @@
+import multiprocessing
+import os
+import threading
+import time
+
+# Commands counted separately; anything else is counted as "other"
+COMMANDS = ('list', 'image', 'get', 'mget', 'range', 'zget', 'add', 'zadd', 'delete', 'mdelete', 'stat',
+            'has', 'link', 'sigs', 'ustart', 'ustatus', 'ucommit', 'uabort', 'bget', 'bput', 'brange',
+            'uchunk', 'bdelta', 'stats', 'other')
+COMMAND_INDEX = {name: i for i, name in enumerate(COMMANDS)}
+COMMAND_INDEX['upload'] = COMMAND_INDEX['add']
+
+# Latency histogram: bucket 0 is below 32 us, bucket k covers [2^(k+4), 2^(k+5)) us,
+# the last one everything from about 2 minutes up
+BUCKETS = 24
+
+# Counters of one command: count, errors, bytes in, bytes out, total latency (us), histogram
+COUNT, ERRORS, BYTES_IN, BYTES_OUT, LATENCY = range(5)
+COMMAND_SIZE = 5 + BUCKETS
+
+# Counters of a thread that belong to no command. Active connections and queue depth are
+# differences of two counters, so opening and closing may happen on different threads.
+OPENED, CLOSED, QUEUED, DEQUEUED = range(len(COMMANDS) * COMMAND_SIZE, len(COMMANDS) * COMMAND_SIZE + 4)
+SLOT_SIZE = len(COMMANDS) * COMMAND_SIZE + 4
+
+# Cache counters of a process, copied from its caches after every request
+GAUGES = ('cache_entries', 'cache_bytes', 'cache_hits', 'cache_misses', 'cache_evictions',
+          'flight_leaders', 'flight_shared', 'validator_hits', 'validator_misses')
+
+# Threads of one process that get a slot of their own
+THREAD_SLOTS = 32
+
+ERROR_STATUS = b'"status": "ERROR"'
+
+
+def is_error(piece):
+    # Whether a response starting with `piece` reports an error; status is the first field of every
+    # response (after "id" in a pipelined one, which comes as a piece of its own)
+    return bytes(piece[:len(ERROR_STATUS) + 2]).lstrip(b'{ ').startswith(ERROR_STATUS)
+
+
+def bucket_of(seconds):
+    return min(BUCKETS - 1, max(0, int(seconds * 1e6).bit_length() - 5))
+
+
+def bucket_bounds(bucket):
+    # (lower, upper) in milliseconds; the last bucket has no upper bound
+    lower = 0.0 if bucket == 0 else 2**(bucket + 4) / 1000
+    upper = None if bucket == BUCKETS - 1 else 2**(bucket + 5) / 1000
+    return lower, upper
+
+
+def percentile(histogram, fraction):
+    # Interpolated linearly inside the bucket the rank falls in
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    rank = fraction * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower, upper = bucket_bounds(bucket)
+            if upper is None:
+                return lower
+            return round(lower + (upper - lower) * (rank - seen) / count, 3)
+        seen += count
+    return 0.0
+
+
+class ServerStats:
+    """
+    Request metrics of a server, shared by all of its worker processes.
+
+    Every thread of every worker process adds to its own slot of counters, so
+    recording takes no lock and no thread ever waits for another. The slots live
+    in shared memory allocated before the workers are forked; snapshot() adds them
+    up when STATS is asked, in whichever process answers it. A process with more
+    than `threads` recording threads lets the extra ones share slots, which may
+    lose an increment now and then but never blocks.
+    """
+
+    def __init__(self, processes=1, threads=THREAD_SLOTS):
+        self.processes = processes
+        self.threads = threads
+        self.counters = multiprocessing.RawArray('Q', processes * threads * SLOT_SIZE)
+        self.gauges = multiprocessing.RawArray('Q', processes * len(GAUGES))
+        # Indexing a memoryview is several times cheaper than indexing the ctypes array
+        self.view = memoryview(self.counters).cast('B').cast('Q')
+        self.gauge_view = memoryview(self.gauges).cast('B').cast('Q')
+        self.started = time.time()
+        self.worker = 0
+        self.gauge_source = None
+        self._reset_threads()
+
+    def _reset_threads(self):
+        self.local = threading.local()
+        self.next_thread = 0
+        self.lock = threading.Lock()
+
+    def bind(self, worker):
+        # Called in a worker process: its threads use the slots of worker number `worker`
+        self.worker = worker % self.processes
+        self._reset_threads()
+
+    def _slot(self):
+        base = getattr(self.local, 'base', None)
+        if base is None:
+            with self.lock:
+                thread = self.next_thread % self.threads
+                self.next_thread += 1
+            base = self.local.base = (self.worker * self.threads + thread) * SLOT_SIZE
+        return base
+
+    def count(self, counter, n=1):
+        self.view[self._slot() + counter] += n
+
+    def record(self, command, seconds, bytes_in=0, bytes_out=0, ok=True):
+        view = self.view
+        base = self._slot() + COMMAND_INDEX.get(command, COMMAND_INDEX['other']) * COMMAND_SIZE
+        view[base + COUNT] += 1
+        if not ok:
+            view[base + ERRORS] += 1
+        view[base + BYTES_IN] += bytes_in
+        view[base + BYTES_OUT] += bytes_out
+        view[base + LATENCY] += int(seconds * 1e6)
+        view[base + 5 + bucket_of(seconds)] += 1
+        self.publish()
+
+    def publish(self):
+        if self.gauge_source is not None:
+            base = self.worker * len(GAUGES)
+            for i, value in enumerate(self.gauge_source()):
+                self.gauge_view[base + i] = value
+
+    def snapshot(self):
+        self.publish()
+        view = self.view
+        slots = self.processes * self.threads
+        totals = [0] * SLOT_SIZE
+        per_worker = [0] * self.processes
+        for slot in range(slots):
+            values = view[slot * SLOT_SIZE:(slot + 1) * SLOT_SIZE].tolist()
+            for i, value in enumerate(values):
+                if value:
+                    totals[i] += value
+            per_worker[slot // self.threads] += sum(values[COUNT:OPENED:COMMAND_SIZE])
+
+        commands = {}
+        overall = [0] * BUCKETS
+        for i, name in enumerate(COMMANDS):
+            counters = totals[i * COMMAND_SIZE:(i + 1) * COMMAND_SIZE]
+            if not counters[COUNT]:
+                continue
+            histogram = counters[5:]
+            overall = [a + b for a, b in zip(overall, histogram)]
+            commands[name] = dict(
+                count=counters[COUNT], errors=counters[ERRORS],
+                bytes_in=counters[BYTES_IN], bytes_out=counters[BYTES_OUT],
+                mean_ms=round(counters[LATENCY] / counters[COUNT] / 1000, 3),
+                p50_ms=percentile(histogram, 0.50), p95_ms=percentile(histogram, 0.95),
+                p99_ms=percentile(histogram, 0.99),
+                # [upper bound in ms (null = unbounded), count] of the buckets in use
+                histogram=[[bucket_bounds(b)[1], n] for b, n in enumerate(histogram) if n])
+
+        gauges = dict.fromkeys(GAUGES, 0)
+        for worker in range(self.processes):
+            for i, name in enumerate(GAUGES):
+                gauges[name] += self.gauge_view[worker * len(GAUGES) + i]
+        cache_lookups = gauges['cache_hits'] + gauges['cache_misses']
+        validator_lookups = gauges['validator_hits'] + gauges['validator_misses']
+
+        return dict(
+            uptime=round(time.time() - self.started, 1),
+            processes=self.processes,
+            requests=sum(c['count'] for c in commands.values()),
+            errors=sum(c['errors'] for c in commands.values()),
+            bytes_in=sum(c['bytes_in'] for c in commands.values()),
+            bytes_out=sum(c['bytes_out'] for c in commands.values()),
+            p50_ms=percentile(overall, 0.50), p95_ms=percentile(overall, 0.95), p99_ms=percentile(overall, 0.99),
+            active_connections=max(0, totals[OPENED] - totals[CLOSED]),
+            connections=totals[OPENED],
+            queue_depth=max(0, totals[QUEUED] - totals[DEQUEUED]),
+            requests_per_worker=per_worker,
+            commands=commands,
+            cache=dict(
+                response=dict(entries=gauges['cache_entries'], bytes=gauges['cache_bytes'],
+                              hits=gauges['cache_hits'], misses=gauges['cache_misses'],
+                              evictions=gauges['cache_evictions'],
+                              hit_rate=round(gauges['cache_hits'] / cache_lookups, 4) if cache_lookups else 0.0),
+                get_flight=dict(leaders=gauges['flight_leaders'], shared=gauges['flight_shared']),
+                validators=dict(hits=gauges['validator_hits'], misses=gauges['validator_misses'],
+                                hit_rate=round(gauges['validator_hits'] / validator_lookups, 4)
+                                if validator_lookups else 0.0)))
+
+
+_stats = None
+_gauge_source = None
+
+
+def setup_stats(processes=1, threads=THREAD_SLOTS):
+    """
+    Allocate the shared counters for `processes` worker processes of up to
+    `threads` threads each. A pre-fork server calls this before forking, so all
+    workers write to the same memory; a single-process server may skip it.
+    """
+    global _stats
+    _stats = ServerStats(processes, threads)
+    _stats.gauge_source = _gauge_source
+    return _stats
+
+
+def server_stats():
+    return _stats if _stats is not None else setup_stats()
+
+
+def watch_gauges(source):
+    # source() returns this process's cache counters, in the order of GAUGES
+    global _gauge_source
+    _gauge_source = source
+    if _stats is not None:
+        _stats.gauge_source = source
+
+
+def _reset_after_fork():
+    # The forking thread's slot belongs to the parent
+    if _stats is not None:
+        _stats._reset_threads()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,193 @@
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+
+# FILE_DEDUP=0 stores every upload as an independent file
+DEDUP_ENABLED = os.environ.get('FILE_DEDUP', '1') != '0'
+OBJECTS_DIR = '.objects'
+DIGEST = re.compile(r'[0-9a-f]{64}')
+
+
+def reserved(filename):
+    # Names clients may not use: absolute paths and anything that does not resolve inside
+    # the uploads directory (the working directory), and hidden names, since the store's
+    # objects, session and temp files are all hidden
+    if not filename or os.path.isabs(filename):
+        return True
+    if any(part.startswith('.') for part in filename.split('/')):
+        return True
+    root = os.getcwd()
+    return os.path.commonpath([root, os.path.abspath(filename)]) != root
+
+
+def fd_digest(fd, chunk_size=2**20):
+    # sha256 of an open file, read with pread so its file position is left alone
+    digest = hashlib.sha256()
+    offset = 0
+    while True:
+        chunk = os.pread(fd, chunk_size, offset)
+        if not chunk:
+            return digest.hexdigest()
+        digest.update(chunk)
+        offset += len(chunk)
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return fd_digest(f.fileno())
+
+
+class ContentStore:
+    """
+    Content-addressed storage for uploaded files.
+
+    Each distinct content is kept once, as .objects/<sha256>, and every filename
+    holding that content is a hard link to it. The link count is the reference
+    count: the object entry itself is one link, so an object whose st_nlink drops
+    to 1 is no longer used by any name and is removed.
+
+    Files are only ever replaced by rename, never rewritten in place, so writing
+    one name cannot change the content of another. All state lives in the
+    filesystem and changes are serialised with an flock, so every worker process
+    shares the same store.
+    """
+
+    def __init__(self, path=OBJECTS_DIR, enabled=DEDUP_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        # inode -> digest of the objects seen so far; rebuilt from the directory on a miss
+        self.inodes = {}
+        self.inodes_lock = threading.Lock()
+        if enabled:
+            os.makedirs(path, exist_ok=True)
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest)
+
+    @contextmanager
+    def _locked(self):
+        # flock conflicts between separate open()s, so this serialises threads as well as processes
+        fd = os.open(os.path.join(self.path, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def lookup(self, digest):
+        # Size of the stored content with this digest, None if it is not held
+        if not self.enabled or not DIGEST.fullmatch(digest):
+            return None
+        try:
+            return os.stat(self.object_path(digest)).st_size
+        except FileNotFoundError:
+            return None
+
+    def digest(self, st):
+        # sha256 of a file from its stat result, if it is a link to a stored object (else None)
+        if not self.enabled or st.st_nlink < 2:
+            return None
+        return self._digest_for(st.st_ino)
+
+    def publish(self, temp_path, filename, digest=None):
+        """
+        Moves a finished upload from temp_path to filename. The content is stored
+        under its digest (computed here if not given); if it is already stored,
+        filename is linked to the existing object and temp_path is discarded.
+        """
+        if not self.enabled:
+            os.replace(temp_path, filename)
+            return
+        if digest is None:
+            digest = file_digest(temp_path)
+
+        obj = self.object_path(digest)
+        with self._locked():
+            old = self._stat(filename)
+            try:
+                os.link(temp_path, obj)
+            except FileExistsError:
+                os.remove(temp_path)
+                self._link(obj, filename, old)
+                return
+            except OSError:
+                # No hard links on this filesystem: keep the upload as a plain file
+                os.replace(temp_path, filename)
+                self._release(old)
+                return
+            os.replace(temp_path, filename)
+            self._release(old)
+
+    def link(self, digest, filename):
+        # Makes filename refer to already stored content; returns its size
+        if not self.enabled:
+            raise ValueError("Deduplikasi tidak aktif")
+        if not DIGEST.fullmatch(digest):
+            raise ValueError(f"Invalid digest {digest}")
+
+        obj = self.object_path(digest)
+        with self._locked():
+            try:
+                size = os.stat(obj).st_size
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Content {digest} not found") from None
+            self._link(obj, filename, self._stat(filename))
+        return size
+
+    def remove(self, filename):
+        if not self.enabled:
+            os.remove(filename)
+            return
+        with self._locked():
+            old = self._stat(filename)
+            os.remove(filename)
+            self._release(old)
+
+    def _stat(self, filename):
+        try:
+            return os.stat(filename)
+        except FileNotFoundError:
+            return None
+
+    def _link(self, obj, filename, old):
+        obj_ino = os.stat(obj).st_ino
+        if old is not None and old.st_ino == obj_ino:
+            # Already this content (rename between two links of one inode would do nothing)
+            return
+        temp_path = f".link-{uuid.uuid4().hex}.tmp"
+        os.link(obj, temp_path)
+        os.replace(temp_path, filename)
+        self._release(old)
+
+    def _release(self, old):
+        # Called with the store locked once `old` (a stat taken before) no longer has its name.
+        # If it had 2 links, only the object entry is left and the object can go.
+        if old is None or old.st_nlink != 2:
+            return
+        digest = self._digest_for(old.st_ino)
+        if digest is None:
+            return
+        obj = self.object_path(digest)
+        st = os.stat(obj)
+        if st.st_ino == old.st_ino and st.st_nlink == 1:
+            os.remove(obj)
+            with self.inodes_lock:
+                self.inodes.pop(old.st_ino, None)
+
+    def _digest_for(self, ino):
+        with self.inodes_lock:
+            digest = self.inodes.get(ino)
+            if digest is not None:
+                try:
+                    if os.stat(self.object_path(digest)).st_ino == ino:
+                        return digest
+                except FileNotFoundError:
+                    pass
+            # Inode numbers come with the directory entries, so this is a single readdir
+            with os.scandir(self.path) as it:
+                self.inodes = {entry.inode(): entry.name for entry in it if DIGEST.fullmatch(entry.name)}
+            return self.inodes.get(ino)
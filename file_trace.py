@@ -0,0 +1,175 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+
+# FILE_TRACE=1 records the phases of every request; the last FILE_TRACE_BUFFER traces of
+# each process are kept. SIGUSR1 writes them to FILE_TRACE_DIR/trace-<pid>.jsonl.
+TRACE_ENABLED = os.environ.get('FILE_TRACE', '0') == '1'
+TRACE_BUFFER = int(os.environ.get('FILE_TRACE_BUFFER', 1000))
+# Resolved at import, before the server changes into uploads/
+TRACE_DIR = os.path.abspath(os.environ.get('FILE_TRACE_DIR', 'traces'))
+
+class _TraceLocal(threading.local):
+    # A class default, so looking it up in a thread that never traced raises nothing
+    trace = None
+
+
+_local = _TraceLocal()
+traces = deque(maxlen=TRACE_BUFFER)
+
+
+class Trace:
+    # Phases of one request, keyed by their stack ("recv", "get;disk_read", ...). A phase
+    # entered many times (e.g. once per chunk) is kept as one entry with a count and total time.
+    __slots__ = ('command', 'request', 'thread', 'wall', 'start', 'end', 'stack', 'phases')
+
+    def __init__(self):
+        self.command = None
+        self.request = ''
+        self.thread = threading.current_thread().name
+        self.wall = time.time()
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.stack = []
+        # stack -> [first start (ns after the request started), count, total ns]
+        self.phases = {}
+
+    def as_dict(self):
+        return dict(pid=os.getpid(), thread=self.thread, command=self.command, request=self.request,
+                    start=round(self.wall, 6), duration_ms=round((self.end - self.start) / 1e6, 3),
+                    phases=[dict(stack=stack, start_ms=round(first / 1e6, 3), count=count,
+                                 ms=round(total / 1e6, 3))
+                            for stack, (first, count, total) in self.phases.items()])
+
+
+class _Phase:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.trace.stack.append(self.name)
+        self.started = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        now = time.perf_counter_ns()
+        trace = self.trace
+        stack = ';'.join(trace.stack)
+        trace.stack.pop()
+        entry = trace.phases.get(stack)
+        if entry is None:
+            trace.phases[stack] = [self.started - trace.start, 1, now - self.started]
+        else:
+            entry[1] += 1
+            entry[2] += now - self.started
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """
+    Context manager timing one phase of the request traced in this thread; nested
+    phases are recorded under their parent. With tracing off it returns a shared
+    no-op at once. Do not yield from inside a phase: whatever the consumer does
+    until the generator resumes would be counted in it.
+    """
+    if not TRACE_ENABLED:
+        return _NO_PHASE
+    trace = _local.trace
+    return _NO_PHASE if trace is None else _Phase(trace, name)
+
+
+def begin_trace():
+    # Starts tracing a request in this thread; None when tracing is off
+    if not TRACE_ENABLED:
+        return None
+    trace = _local.trace = Trace()
+    return trace
+
+
+def label_trace(command, request=''):
+    trace = _local.trace
+    if trace is not None:
+        trace.command = command
+        trace.request = request[:100]
+
+
+def finish_trace(trace):
+    # Keeps the trace if a request was actually served (labelled) during it
+    if trace is None:
+        return
+    _local.trace = None
+    if trace.command is not None and trace.end is None:
+        trace.end = time.perf_counter_ns()
+        traces.append(trace)
+
+
+def recent_traces():
+    # Finished traces of this process, oldest first
+    return [trace.as_dict() for trace in list(traces)]
+
+
+def dump_traces(path=None):
+    # Writes the buffered traces as JSON lines; returns the file name
+    if path is None:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"trace-{os.getpid()}.jsonl")
+    with open(path, 'w') as f:
+        for trace in recent_traces():
+            f.write(json.dumps(trace) + "\n")
+    return path
+
+
+def install_trace_signal(signum=signal.SIGUSR1):
+    signal.signal(signum, lambda signum, frame: dump_traces())
+
+
+def fold(lines):
+    """
+    Collapsed stacks ("command;phase;subphase" -> microseconds) from trace JSON
+    lines, as flamegraph.pl and speedscope read them. Each stack gets its self
+    time: its total minus that of the phases directly inside it.
+    """
+    folded = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        trace = json.loads(line)
+        totals = {p['stack']: p['ms'] * 1000 for p in trace['phases']}
+        children = {}
+        for stack, total in totals.items():
+            parent = stack.rpartition(';')[0]
+            children[parent] = children.get(parent, 0) + total
+        root = trace['command']
+        for stack, total in totals.items():
+            key = f"{root};{stack}"
+            folded[key] = folded.get(key, 0) + max(0, total - children.get(stack, 0))
+        # Time of the request outside any phase
+        folded[root] = folded.get(root, 0) + max(0, trace['duration_ms'] * 1000 - children.get('', 0))
+    return folded
+
+
+if __name__ == '__main__':
+    # python file_trace.py traces/trace-*.jsonl > requests.folded
+    folded = {}
+    for name in sys.argv[1:]:
+        with open(name) as f:
+            for stack, us in fold(f).items():
+                folded[stack] = folded.get(stack, 0) + us
+    for stack, us in sorted(folded.items()):
+        print(f"{stack} {round(us)}")
@@ -0,0 +1,961 @@
+import errno
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from file_profile import begin_profile, end_profile
+from file_stats import CLOSED, DEQUEUED, OPENED, QUEUED, is_error, server_stats
+from file_trace import begin_trace, finish_trace, label_trace, phase
+
+TERMINATOR = b"\r\n\r\n"
+
+# Binary frame header: status (1 byte), panjang nama (2 byte), panjang payload (8 byte),
+# diikuti nama file (utf-8) lalu payload mentah tanpa base64
+FRAME_HEADER = struct.Struct('!BHQ')
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+BINARY_COMMANDS = ('bget', 'bput', 'brange', 'uchunk', 'bdelta')
+# Binary commands followed by a raw payload of the length given last in the request line
+BINARY_UPLOADS = ('bput', 'uchunk', 'bdelta')
+
+# BRANGE payloads start with offset, total file size and mtime_ns (big-endian),
+# followed by the requested bytes
+RANGE_HEADER = struct.Struct('!QQQ')
+
+SENDFILE_BLOCK = 2**20
+BUFFER_SIZE = 2**16
+
+# Peak memory of a streaming upload is bounded by this many bytes per connection
+UPLOAD_CHUNK_SIZE = 2**20
+UPLOAD_COMMANDS = (b'add', b'upload', b'zadd')
+MAX_HEADER = 4096
+
+# Seconds a keep-alive connection may stay silent between requests before the server closes it
+IDLE_TIMEOUT = float(os.environ.get('FILE_IDLE_TIMEOUT', 60))
+
+# Pipelined requests ("#id COMMAND ...") run on a per-process executor of this many threads,
+# with at most PIPELINE_DEPTH of them in flight per connection
+PIPELINE_WORKERS = int(os.environ.get('FILE_PIPELINE_WORKERS', 8))
+PIPELINE_DEPTH = 64
+
+
+class RequestReader:
+    """
+    Receive buffer for terminator-delimited requests and responses.
+
+    Data is received with recv_into straight into a bytearray that grows by
+    doubling, and only the newly received tail is scanned for the terminator,
+    so reading a message costs time linear in its size.
+    """
+
+    def __init__(self, connection, chunk_size=2**16):
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self._data = bytearray(min(chunk_size, 2**16))
+        self._start = 0
+        self._end = 0
+        self._scanned = 0
+        self._checked = 0
+
+    def read_request(self, detect=None):
+        """
+        Return (request, header) where request is the next message without its
+        terminator. If `detect` is given it is called with the first MAX_HEADER
+        buffered bytes while the message is still incomplete; a non-None result
+        is returned as header, leaving the message in the buffer. Returns
+        (None, None) once the peer has closed the connection.
+        """
+        while True:
+            end = self._data.find(TERMINATOR, max(self._start, self._scanned - len(TERMINATOR) + 1), self._end)
+            if end >= 0:
+                request = bytes(self._data[self._start:end])
+                self._consume(end + len(TERMINATOR))
+                return request, None
+            self._scanned = self._end
+
+            if detect is not None and self._end > self._start and self._checked < MAX_HEADER:
+                header = detect(bytes(self._data[self._start:self._start + MAX_HEADER]))
+                self._checked = self._end - self._start
+                if header is not None:
+                    return None, header
+
+            if not self._fill():
+                return None, None
+
+    @property
+    def buffered(self):
+        return self._end - self._start
+
+    def take(self):
+        # Hand over everything buffered, e.g. to a streaming upload
+        data = bytes(self._data[self._start:self._end])
+        self._consume(self._end)
+        return data
+
+    def unread(self, data):
+        # Put back bytes received past the end of a streamed payload
+        if not data:
+            return
+        if len(data) > len(self._data):
+            self._data = bytearray(len(data))
+        self._data[:len(data)] = data
+        self._start = self._scanned = self._checked = 0
+        self._end = len(data)
+
+    def _consume(self, position):
+        self._start = self._scanned = position
+        self._checked = 0
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+            # Do not keep a buffer sized for one huge message for the rest of the connection
+            if len(self._data) > 4 * self.chunk_size:
+                self._data = bytearray(min(self.chunk_size, 2**16))
+
+    def _fill(self):
+        if self._end == len(self._data):
+            self._make_room()
+        with memoryview(self._data) as view, view[self._end:self._end + self.chunk_size] as free:
+            n = self.connection.recv_into(free)
+        self._end += n
+        return n > 0
+
+    def _make_room(self):
+        used = self._end - self._start
+        if self._start > 0 and used <= len(self._data) // 2:
+            self._data[:used] = self._data[self._start:self._end]
+            self._scanned -= self._start
+            self._start, self._end = 0, used
+        else:
+            self._data.extend(bytes(len(self._data)))
+
+
+def pack_header(status, name, payload_length):
+    name_bytes = name.encode()
+    return FRAME_HEADER.pack(status, len(name_bytes), payload_length) + name_bytes
+
+
+def send_frame(connection, status, name, payload=b''):
+    # Returns the number of bytes sent
+    header = pack_header(status, name, len(payload))
+    connection.sendall(header)
+    if payload:
+        connection.sendall(payload)
+    return len(header) + len(payload)
+
+
+def send_file(connection, fileobj, offset=0, count=None):
+    """
+    Stream `count` bytes of `fileobj` starting at `offset` straight from disk to the
+    socket with os.sendfile, falling back to a fixed-size buffered loop where
+    sendfile is not available. Memory use does not depend on the file size.
+    """
+    if count is None:
+        count = os.fstat(fileobj.fileno()).st_size - offset
+    if count <= 0:
+        return 0
+
+    if hasattr(os, 'sendfile'):
+        sent = _send_file_zero_copy(connection, fileobj, offset, count)
+        if sent is not None:
+            return sent
+    return _send_file_buffered(connection, fileobj, offset, count)
+
+
+def _send_file_zero_copy(connection, fileobj, offset, count):
+    # Returns None if sendfile is unsupported for this socket/file pair
+    sock_fd = connection.fileno()
+    file_fd = fileobj.fileno()
+    timeout = connection.gettimeout()
+    sent = 0
+    with selectors.DefaultSelector() as selector:
+        selector.register(connection, selectors.EVENT_WRITE)
+        while sent < count:
+            try:
+                n = os.sendfile(sock_fd, file_fd, offset + sent, min(count - sent, SENDFILE_BLOCK))
+            except BlockingIOError:
+                # Sockets with a timeout are non-blocking underneath
+                if not selector.select(timeout):
+                    raise TimeoutError("timed out")
+                continue
+            except OSError as e:
+                if sent == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    return None
+                raise
+            if n == 0:
+                raise ConnectionError(f"File ended after {sent} of {count} bytes")
+            sent += n
+    return sent
+
+
+def _send_file_buffered(connection, fileobj, offset, count):
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    fileobj.seek(offset)
+    sent = 0
+    while sent < count:
+        n = fileobj.readinto(view[:min(BUFFER_SIZE, count - sent)])
+        if not n:
+            raise ConnectionError(f"File ended after {sent} of {count} bytes")
+        connection.sendall(view[:n])
+        sent += n
+    return sent
+
+
+def recv_exact(connection, size, pending=b''):
+    """
+    Read exactly `size` bytes, consuming `pending` (bytes already received) first.
+    Returns (data, leftover) where leftover is whatever followed the data in `pending`.
+    """
+    if len(pending) >= size:
+        return bytes(pending[:size]), pending[size:]
+
+    data = bytearray(size)
+    view = memoryview(data)
+    view[:len(pending)] = pending
+    received = len(pending)
+    while received < size:
+        n = connection.recv_into(view[received:], min(size - received, 2**20))
+        if n == 0:
+            raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+        received += n
+    return data, b''
+
+
+def receive_raw_upload(connection, writer, size, pending=b'', chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Feed exactly `size` raw payload bytes to `writer` as they arrive.
+    Returns the bytes received after the payload.
+    """
+    head = pending[:size]
+    if head:
+        writer.write(head)
+    remaining = size - len(head)
+    if remaining == 0:
+        return pending[size:]
+
+    buffer = bytearray(min(chunk_size, remaining))
+    view = memoryview(buffer)
+    while remaining > 0:
+        n = connection.recv_into(view, min(len(buffer), remaining))
+        if n == 0:
+            raise ConnectionError(f"Connection closed with {remaining} payload bytes outstanding")
+        writer.write(view[:n])
+        remaining -= n
+    return b''
+
+
+def receive_text_upload(connection, writer, pending=b'', chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Feed base64 content to `writer` until the request terminator.
+    Returns the bytes received after the terminator.
+    """
+    data = pending
+    keep = len(TERMINATOR) - 1
+    while True:
+        end = data.find(TERMINATOR)
+        if end >= 0:
+            writer.write(data[:end])
+            return data[end + len(TERMINATOR):]
+
+        # Hold back a few bytes in case the terminator is split across two reads
+        if len(data) > keep:
+            writer.write(data[:-keep])
+            data = data[-keep:]
+
+        chunk = connection.recv(chunk_size)
+        if not chunk:
+            raise ConnectionError("Connection closed before upload was complete")
+        data += chunk
+
+
+def upload_header(buffer):
+    """
+    Detect a streaming ADD/UPLOAD header ("ADD namafile ") or ZADD header
+    ("ZADD namafile kompresi ") at the start of `buffer`.
+    Returns (command, filename, header_length, compression) or None.
+    """
+    end = buffer.find(TERMINATOR, 0, MAX_HEADER)
+    head = buffer[:end if end >= 0 else MAX_HEADER]
+    command = head.split(b' ', 1)[0].lower()
+    if command not in UPLOAD_COMMANDS:
+        return None
+    fields = 3 if command == b'zadd' else 2
+    parts = head.split(b' ', fields)
+    if len(parts) <= fields:
+        return None
+    compression = parts[2].decode() if command == b'zadd' else None
+    return parts[0].decode(), parts[1].decode(), sum(len(p) + 1 for p in parts[:fields]), compression
+
+
+def handle_upload(connection, address, fp, c_request, filename, pending, size=None,
+                  chunk_size=UPLOAD_CHUNK_SIZE, args=(), compression=None):
+    """
+    Stream an upload to disk. `size` is the payload length for BPUT/UCHUNK, None for
+    terminator-delimited base64 (ADD/UPLOAD/ZADD). Returns (result, leftover, payload
+    bytes received).
+    """
+    result = fp.begin_upload(c_request, filename, args, compression)
+    if result['status'] != 'OK':
+        return result, None, 0
+
+    writer = result['data_file']
+    try:
+        with phase('recv'):
+            if size is None:
+                pending = receive_text_upload(connection, writer, pending, chunk_size)
+            else:
+                pending = receive_raw_upload(connection, writer, size, pending, chunk_size)
+    except Exception:
+        writer.abort()
+        raise
+
+    logging.info("Upload of %s received from %s (%s bytes)", filename, address, writer.size)
+    # Base64 text is 4 bytes per 3 bytes the writer decoded from it
+    received = size if size is not None else 4 * -(-writer.received // 3)
+    with phase('commit'):
+        result = fp.finish_upload(writer)
+    return result, pending, received
+
+
+def read_frame(connection, pending=b''):
+    """
+    Read one binary frame. Returns (status, name, payload, leftover).
+    """
+    header, pending = recv_exact(connection, FRAME_HEADER.size, pending)
+    status, name_length, payload_length = FRAME_HEADER.unpack(header)
+    name, pending = recv_exact(connection, name_length, pending)
+    payload, pending = recv_exact(connection, payload_length, pending)
+    return status, bytes(name).decode(), payload, pending
+
+
+# Fields between the name and the payload length of each binary upload
+BINARY_UPLOAD_ARGS = {'bput': 0, 'uchunk': 1, 'bdelta': 2}
+BINARY_UPLOAD_USAGE = (b"BPUT requires filename and payload length, UCHUNK requires session, chunk index "
+                       b"and payload length, BDELTA requires filename, base etag, target digest and payload length")
+
+
+def binary_upload_params(parts):
+    """
+    Parse "BPUT namafile length", "UCHUNK session index length" or
+    "BDELTA namafile base_etag target_digest length".
+    Returns (fields between name and length, payload length), or None if malformed.
+    """
+    count = BINARY_UPLOAD_ARGS[parts[0].lower()]
+    if len(parts) < count + 3 or not parts[count + 2].isdigit():
+        return None
+    args = parts[2:count + 2]
+    if parts[0].lower() == 'uchunk' and not args[0].isdigit():
+        return None
+    return args, int(parts[count + 2])
+
+
+def range_prefix(c_request, result):
+    if c_request != 'brange':
+        return b''
+    return RANGE_HEADER.pack(result['data_offset'], result['data_size'], result['data_mtime'])
+
+
+def handle_binary(connection, address, fp, request, reader):
+    """
+    Serve BGET/BPUT/BRANGE/UCHUNK/BDELTA. Returns False if the connection can no longer be framed
+    and must be closed.
+    """
+    start_time = time.perf_counter()
+    parts = request.split()
+    c_request = parts[0].lower()
+    name = parts[1] if len(parts) > 1 else ''
+    received = len(request) + len(TERMINATOR)
+
+    if c_request in BINARY_UPLOADS:
+        params = binary_upload_params(parts)
+        if params is None:
+            sent = send_frame(connection, STATUS_ERROR, name, BINARY_UPLOAD_USAGE)
+            server_stats().record(c_request, time.perf_counter() - start_time, received, sent, ok=False)
+            return False
+        args, size = params
+        result, pending, payload = handle_upload(connection, address, fp, c_request, name, reader.take(),
+                                                 size, args=args)
+        received += payload
+        if pending is None:
+            sent = send_frame(connection, STATUS_ERROR, name, str(result['data']).encode())
+            server_stats().record(c_request, time.perf_counter() - start_time, received, sent, ok=False)
+            return False
+        reader.unread(pending)
+    else:
+        with phase('open'):
+            result = fp.proses_binary(request)
+
+    if result['status'] == 'OK' and 'data_offset' in result:
+        with result['data_file'] as fileobj, phase('sendfile'):
+            prefix = range_prefix(c_request, result)
+            header = pack_header(STATUS_OK, result['data_namafile'], len(prefix) + result['data_length']) + prefix
+            connection.sendall(header)
+            send_file(connection, fileobj, result['data_offset'], result['data_length'])
+        sent = len(header) + result['data_length']
+        logging.info("Sent %s bytes of %s to %s", result['data_length'], result['data_namafile'], address)
+    elif result['status'] == 'OK':
+        body = result['data_file'] if 'data_file' in result else str(result['data']).encode()
+        with phase('sendall'):
+            sent = send_frame(connection, STATUS_OK, result.get('data_namafile', name), body)
+    else:
+        with phase('sendall'):
+            sent = send_frame(connection, STATUS_ERROR, name, str(result['data']).encode())
+    server_stats().record(c_request, time.perf_counter() - start_time, received, sent,
+                          ok=result['status'] == 'OK')
+    return True
+
+
+def handle_request(connection, address, fp, request, reader):
+    """
+    Serve one complete request. Returns False if the connection must be closed.
+    """
+    received = len(request) + len(TERMINATOR)
+    request = request.decode().strip()
+    c_request = request.split(' ', 1)[0].lower()
+    label_trace(c_request, request)
+
+    start_time = time.perf_counter()
+    if c_request in BINARY_COMMANDS:
+        keep_open = handle_binary(connection, address, fp, request, reader)
+        logging.info("Binary request processed in %.2f seconds", time.perf_counter() - start_time)
+        return keep_open
+
+    chunks = fp.proses_stream(request)
+    if chunks is not None:
+        total_bytes = 0
+        ok = True
+        for piece in chunks:
+            if not total_bytes:
+                ok = not is_error(piece)
+            with phase('sendall'):
+                connection.sendall(piece)
+            total_bytes += len(piece)
+        connection.sendall(TERMINATOR)
+        elapsed = time.perf_counter() - start_time
+        server_stats().record(c_request, elapsed, received, total_bytes + len(TERMINATOR), ok)
+        logging.info("Streamed response to %s (%s bytes) in %.2f seconds", address, total_bytes, elapsed)
+        return True
+
+    processed = fp.proses_string(request)
+    logging.info("Request processed in %.2f seconds", time.perf_counter() - start_time)
+
+    response_bytes = (processed + "\r\n\r\n").encode()
+    logging.info("Sending response (%s bytes)", len(response_bytes))
+    with phase('sendall'):
+        connection.sendall(response_bytes)
+    server_stats().record(c_request, time.perf_counter() - start_time, received, len(response_bytes),
+                          not is_error(response_bytes))
+    logging.info("Response sent to %s", address)
+    return True
+
+
+_request_executor = None
+_request_executor_lock = threading.Lock()
+
+
+def request_executor():
+    # Created on first use, so pre-fork workers each get their own threads after the fork
+    global _request_executor
+    with _request_executor_lock:
+        if _request_executor is None:
+            _request_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS,
+                                                   thread_name_prefix='pipeline')
+        return _request_executor
+
+
+def split_tag(request):
+    """
+    Split a pipelined request "#id COMMAND ..." into (id, "COMMAND ...").
+    """
+    tag, _, command = request.partition(' ')
+    return tag[1:], command.strip()
+
+
+def tagged_response(fp, request_id, command):
+    """
+    Process a pipelined text command and return its response pieces, with "id" as
+    the first field of the JSON object. The command runs here, so callers can do
+    this before taking the send lock; only large files are still read while sending.
+    Binary commands cannot be pipelined since frames carry no id.
+    """
+    c_request = command.split(' ', 1)[0].lower()
+    if c_request in BINARY_COMMANDS:
+        pieces = [json.dumps(dict(status='ERROR', data='Perintah biner tidak dapat dipipeline')).encode()]
+    else:
+        pieces = fp.proses_stream(command)
+        if pieces is None:
+            pieces = [fp.proses_string(command).encode()]
+    return _with_id(request_id, pieces)
+
+
+def _with_id(request_id, pieces):
+    yield b'{"id": ' + json.dumps(request_id).encode() + b', '
+    first = True
+    for piece in pieces:
+        if first:
+            # Every response is a JSON object; drop its opening brace, the id piece replaces it
+            piece = memoryview(piece)[1:]
+            first = False
+        yield piece
+
+
+class Pipeline:
+    """
+    Runs the pipelined requests of one connection concurrently on the request
+    executor. Each response echoes its request id and is written whole under the
+    connection's send lock, in completion order, so a client can keep many requests
+    in flight and match the responses by id.
+    """
+
+    def __init__(self, connection, address, fp, depth=PIPELINE_DEPTH):
+        self.connection = connection
+        self.address = address
+        self.fp = fp
+        self.send_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(depth)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.error = None
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+
+    @property
+    def busy(self):
+        with self.lock:
+            return self.in_flight > 0
+
+    def submit(self, request):
+        # Blocks while `depth` requests are in flight, which stops reading from the client
+        request_id, command = split_tag(request)
+        self.slots.acquire()
+        with self.lock:
+            self.in_flight += 1
+        try:
+            request_executor().submit(self._run, request_id, command)
+        except Exception:
+            self._finished()
+            raise
+
+    def wait(self):
+        # Until every in-flight request is answered or the client sends more, whichever is first
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_READ)
+            selector.register(self.wakeup_recv, selectors.EVENT_READ)
+            while self.busy:
+                for key, _ in selector.select():
+                    if key.fileobj is self.connection:
+                        return
+                    self._clear_wakeup()
+
+    def drain(self):
+        while self.busy:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.wakeup_recv, selectors.EVENT_READ)
+                selector.select()
+            self._clear_wakeup()
+
+    def close(self):
+        self.drain()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+    def _run(self, request_id, command):
+        trace = begin_trace()
+        profile = begin_profile()
+        try:
+            start_time = time.perf_counter()
+            label_trace(command.split(' ', 1)[0].lower(), command)
+            pieces = tagged_response(self.fp, request_id, command)
+            total_bytes = 0
+            ok = True
+            with phase('send_lock'):
+                self.send_lock.acquire()
+            try:
+                if self.error is None:
+                    for i, piece in enumerate(pieces):
+                        if i < 2 and is_error(piece):
+                            ok = False
+                        with phase('sendall'):
+                            self.connection.sendall(piece)
+                        total_bytes += len(piece)
+                    self.connection.sendall(TERMINATOR)
+            finally:
+                self.send_lock.release()
+            elapsed = time.perf_counter() - start_time
+            server_stats().record(command.split(' ', 1)[0].lower(), elapsed,
+                                  len(request_id) + len(command) + 2 + len(TERMINATOR),
+                                  total_bytes + len(TERMINATOR), ok)
+            logging.info("Pipelined request %s from %s answered (%s bytes) in %.2f seconds",
+                         request_id, self.address, total_bytes, elapsed)
+        except Exception as e:
+            # A half-written response cannot be recovered; later responses are not sent either
+            self.error = e
+            logging.error(f"Error answering pipelined request {request_id} from {self.address}: {e}")
+        finally:
+            end_profile(profile)
+            finish_trace(trace)
+            self._finished()
+
+    def _finished(self):
+        with self.lock:
+            self.in_flight -= 1
+            idle = self.in_flight == 0
+        self.slots.release()
+        if idle:
+            try:
+                self.wakeup_send.send(b'\0')
+            except BlockingIOError:
+                pass
+
+    def _clear_wakeup(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class KeepAlive:
+    """
+    Keeps idle keep-alive connections in a selector so that they do not occupy a
+    worker between requests.
+
+    A parked connection is handed to submit(connection, address, reader) once its
+    next request starts to arrive, and closed after `idle_timeout` seconds of
+    silence. With `listener`, new connections are accepted here as well and start
+    out parked. park() may be called from any thread; run() owns the selector.
+    """
+
+    def __init__(self, submit, listener=None, idle_timeout=IDLE_TIMEOUT, timeout=300):
+        self.submit = submit
+        self.listener = listener
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.incoming = []
+        self.lock = threading.Lock()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+
+    def park(self, connection, address, reader=None):
+        with self.lock:
+            self.incoming.append((connection, address, reader))
+        try:
+            self.wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+
+    def run(self):
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        if self.listener is not None:
+            # Non-blocking, so a worker that loses the accept race to another process does not hang
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ)
+
+        while True:
+            deadlines = [key.data[2] for key in self.selector.get_map().values() if key.data is not None]
+            wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            for key, _ in self.selector.select(wait):
+                if key.fileobj is self.wakeup_recv:
+                    self._register_incoming()
+                elif key.fileobj is self.listener:
+                    self._accept()
+                else:
+                    address, reader, _ = key.data
+                    self.selector.unregister(key.fileobj)
+                    self._submit(key.fileobj, address, reader)
+            self._expire()
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                key.fileobj.close()
+        with self.lock:
+            for connection, _, _ in self.incoming:
+                connection.close()
+            self.incoming.clear()
+        self.selector.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+    def _register_incoming(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            incoming, self.incoming = self.incoming, []
+        deadline = time.monotonic() + self.idle_timeout
+        for connection, address, reader in incoming:
+            self.selector.register(connection, selectors.EVENT_READ, (address, reader, deadline))
+
+    def _accept(self):
+        try:
+            connection, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        logging.info("Accepted connection from %s", address)
+        server_stats().count(OPENED)
+        connection.settimeout(self.timeout)
+        # Responses are written in several pieces; do not let the last one wait for an ACK
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.selector.register(connection, selectors.EVENT_READ,
+                               (address, None, time.monotonic() + self.idle_timeout))
+
+    def _submit(self, connection, address, reader):
+        # Dequeued by serve_client once a worker thread takes the connection
+        server_stats().count(QUEUED)
+        try:
+            self.submit(connection, address, reader)
+        except Exception as e:
+            logging.error(f"Error dispatching client {address}: {e}")
+            server_stats().count(DEQUEUED)
+            server_stats().count(CLOSED)
+            connection.close()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None and key.data[2] <= now:
+                logging.info("Connection with %s idle for %.0f seconds, closing",
+                             key.data[0], self.idle_timeout)
+                self.selector.unregister(key.fileobj)
+                key.fileobj.close()
+                server_stats().count(CLOSED)
+
+
+def serve_client(connection, address, fp, chunk_size=2**20, upload_chunk_size=UPLOAD_CHUNK_SIZE,
+                 keep_alive=None, reader=None, idle_timeout=IDLE_TIMEOUT):
+    """
+    Serve any number of requests on one connection.
+
+    With `keep_alive`, the connection is parked there as soon as no request is
+    pending and this call returns; it is resumed with its `reader` when the next
+    request arrives. Without it, this call waits up to `idle_timeout` seconds for
+    each next request and then closes the connection.
+
+    Requests tagged "#id" are pipelined: they are handed to a Pipeline and the next
+    request is read without waiting for the answer. An untagged request is only
+    served once all earlier pipelined ones are answered, so its response stays in order.
+    """
+    if keep_alive is not None:
+        server_stats().count(DEQUEUED)
+    if reader is None:
+        reader = RequestReader(connection, chunk_size)
+        logging.info("Processing client %s", address)
+    timeout = connection.gettimeout()
+    pipeline = None
+    parked = False
+    trace = None
+    profile = None
+    try:
+        while True:
+            # A trace covers one request, from reading it to the end of its response
+            trace = begin_trace()
+            if not reader.buffered:
+                connection.settimeout(idle_timeout)
+            try:
+                with phase('recv'):
+                    request, header = reader.read_request(detect=upload_header)
+            except TimeoutError:
+                logging.info("Connection with %s idle for %.0f seconds, closing", address, idle_timeout)
+                break
+            finally:
+                connection.settimeout(timeout)
+
+            if request is not None and request.startswith(b'#'):
+                if pipeline is None:
+                    pipeline = Pipeline(connection, address, fp)
+                pipeline.submit(request.decode())
+            else:
+                if pipeline is not None:
+                    pipeline.drain()
+                profile = begin_profile()
+                if header is not None:
+                    c_request, filename, header_length, compression = header
+                    label_trace(c_request.lower(), f"{c_request} {filename}")
+                    start_time = time.perf_counter()
+                    pending = reader.take()[header_length:]
+                    result, pending, received = handle_upload(connection, address, fp, c_request, filename,
+                                                              pending, chunk_size=upload_chunk_size,
+                                                              compression=compression)
+                    response_bytes = (json.dumps(result) + "\r\n\r\n").encode()
+                    with phase('sendall'):
+                        connection.sendall(response_bytes)
+                    server_stats().record(c_request.lower(), time.perf_counter() - start_time,
+                                          header_length + received + len(TERMINATOR), len(response_bytes),
+                                          result['status'] == 'OK')
+                    if pending is None:
+                        break
+                    reader.unread(pending)
+                elif request is not None:
+                    logging.info("Complete request received from %s (%s bytes)", address, len(request))
+                    if not handle_request(connection, address, fp, request, reader):
+                        break
+                else:
+                    break
+                end_profile(profile)
+                profile = None
+                finish_trace(trace)
+
+            if pipeline is not None:
+                if pipeline.error is not None:
+                    break
+                if not reader.buffered:
+                    pipeline.wait()
+                if pipeline.busy:
+                    continue
+            if keep_alive is not None and not reader.buffered:
+                if pipeline is not None:
+                    pipeline.close()
+                keep_alive.park(connection, address, reader)
+                parked = True
+                break
+
+    except Exception as e:
+        logging.error(f"Error handling client {address}: {e}")
+    finally:
+        end_profile(profile)
+        finish_trace(trace)
+        if pipeline is not None and not parked:
+            pipeline.close()
+        if not parked:
+            logging.info("Closing connection with %s", address)
+            connection.close()
+            server_stats().count(CLOSED)
+
+
+class ConnectionPool:
+    """
+    Client-side pool of open connections per server address, so consecutive
+    requests skip TCP connection setup.
+
+    A connection is checked out for one exchange (or a series of them) and put
+    back afterwards. A pooled connection the server has meanwhile closed, e.g.
+    after its idle timeout, is detected and replaced.
+    """
+
+    def __init__(self, timeout=300, max_idle=8):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def connection(self, address):
+        sock, _ = self._checkout(address)
+        try:
+            yield sock
+        except BaseException:
+            sock.close()
+            raise
+        self._checkin(address, sock)
+
+    def request(self, address, exchange):
+        """
+        Run exchange(sock) on a pooled connection to `address` and return its result.
+        If a reused connection turns out to be closed before the server answered,
+        the exchange is retried once on a new connection.
+        """
+        sock, reused = self._checkout(address)
+        try:
+            result = exchange(sock)
+        except ConnectionError:
+            sock.close()
+            if not reused:
+                raise
+            sock = self._connect(address)
+            try:
+                result = exchange(sock)
+            except BaseException:
+                sock.close()
+                raise
+        except BaseException:
+            sock.close()
+            raise
+        self._checkin(address, sock)
+        return result
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for socks in idle.values():
+            for sock in socks:
+                sock.close()
+
+    def _connect(self, address):
+        sock = socket.create_connection(address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _checkout(self, address):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Sockets inherited from the parent process belong to the parent
+                self.idle, self.pid = {}, os.getpid()
+            socks = self.idle.get(address, [])
+            while socks:
+                sock = socks.pop()
+                if self._alive(sock):
+                    return sock, True
+                sock.close()
+        return self._connect(address), False
+
+    def _checkin(self, address, sock):
+        with self.lock:
+            socks = self.idle.setdefault(address, [])
+            if len(socks) < self.max_idle and self.pid == os.getpid():
+                socks.append(sock)
+                return
+        sock.close()
+
+    @staticmethod
+    def _alive(sock):
+        # An idle connection has nothing to read; readable means EOF (or stray data) from the server
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(sock, selectors.EVENT_READ)
+                return not selector.select(0)
+        except (OSError, ValueError):
+            return False
+
+
+class ValidatorCache:
+    """
+    Client-side ETags of downloaded files, for conditional GET. An ETag is only
+    offered again while the local copy is unchanged (same size and mtime), so a
+    locally edited or deleted file is always downloaded in full.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        etag, size, mtime_ns = entry
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return etag if (st.st_size, st.st_mtime_ns) == (size, mtime_ns) else None
+
+    def put(self, path, etag):
+        st = os.stat(path)
+        with self.lock:
+            self.entries[os.path.abspath(path)] = (etag, st.st_size, st.st_mtime_ns)
@@ -2,12 +2,25 @@ import os
 import time
 import base64
 import json
-import socket
-from socket import AF_INET, SOCK_STREAM
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
+from file_transfer import ConnectionPool, RequestReader
+
 SERVER_ADDRESS = ('localhost', 45000)
 
+# Each worker thread/process reuses its connection for consecutive requests
+connection_pool = ConnectionPool()
+
+def send_request(request):
+    def exchange(s):
+        s.sendall(request.encode('utf-8'))
+        full_response, _ = RequestReader(s, 2**20).read_request()
+        if full_response is None:
+            raise ConnectionError("Connection closed before response was complete")
+        return full_response
+
+    return json.loads(connection_pool.request(SERVER_ADDRESS, exchange).decode('utf-8').strip())
+
 # Membaca file dan encode base64
 def read_file_base64(filename):
     with open(filename, 'rb') as f:
@@ -17,52 +30,26 @@ def read_file_base64(filename):
 def upload_file_worker(filename):
     try:
         file_content_b64 = read_file_base64(filename)
-        with socket(AF_INET, SOCK_STREAM) as s:
-            s.connect(SERVER_ADDRESS)
-            request = f"UPLOAD {os.path.basename(filename)} {file_content_b64}\r\n"
-            s.sendall(request.encode('utf-8'))
-            
-            full_response = b""
-            while True:
-                data = s.recv(4096)
-                if not data:
-                    break
-                full_response += data
-                if b"\r\n\r\n" in full_response:
-                    break
-            response = full_response.decode('utf-8').strip()
-            resp_json = json.loads(response)
-            if resp_json.get("status") == "OK":
-                return True, len(file_content_b64) * 3 // 4  # approx size in bytes after base64 decode
-            else:
-                return False, 0
+        request = f"UPLOAD {os.path.basename(filename)} {file_content_b64}\r\n\r\n"
+        resp_json = send_request(request)
+        if resp_json.get("status") == "OK":
+            return True, len(file_content_b64) * 3 // 4  # approx size in bytes after base64 decode
+        else:
+            return False, 0
     except Exception as e:
         return False, 0
 
 # Fungsi download
 def download_file_worker(filename):
     try:
-        with socket(AF_INET, SOCK_STREAM) as s:
-            s.connect(SERVER_ADDRESS)
-            request = f"GET {filename}\r\n"
-            s.sendall(request.encode('utf-8'))
-
-            full_response = b""
-            while True:
-                data = s.recv(4096)
-                if not data:
-                    break
-                full_response += data
-                if b"\r\n\r\n" in full_response:
-                    break
-            response = full_response.decode('utf-8').strip()
-            resp_json = json.loads(response)
-            if resp_json.get("status") == "OK":
-                file_b64 = resp_json.get("data_file", "")
-                size_bytes = len(file_b64) * 3 // 4
-                return True, size_bytes
-            else:
-                return False, 0
+        request = f"GET {filename}\r\n\r\n"
+        resp_json = send_request(request)
+        if resp_json.get("status") == "OK":
+            file_b64 = resp_json.get("data_file", "")
+            size_bytes = len(file_b64) * 3 // 4
+            return True, size_bytes
+        else:
+            return False, 0
     except Exception as e:
         return False, 0
 